@@ -1,18 +1,91 @@
 from django.contrib import admin
 
-from .models import Teacher, Section, Student, Course, Enrolment, Period, WeeklySchedule, Classroom, AcademicYear, NonSchoolDay, Lesson, AttendanceRecord
+from .cache import bump_version
+from .jobs import enqueue_calendar_change
+from .schoolcalendar import SchoolCalendar
+from .reportcache import invalidate_reports
+from .summary import flagged_pairs, refresh_daily_summaries, refresh_record_summaries
+from .models import Teacher, Section, Student, Course, Enrolment, Period, WeeklySchedule, Classroom, AcademicYear, NonSchoolDay, Lesson, AttendanceRecord, Job
 
 # Register your models here.
 
+class LessonsDeletingAdmin(admin.ModelAdmin):
+    """Admin of a model whose deletion cascades to lessons, refreshing the
+    summaries and reports of the absent and late records deleted with them.
+    'records_lookup' goes from attendance records to the model."""
+    records_lookup = None
+
+    def marked_pairs(self, objects):
+        return flagged_pairs(AttendanceRecord.objects.filter(**{f"{self.records_lookup}__in": objects}))
+
+    def lessons_deleted(self, marked):
+        refresh_daily_summaries(marked)
+        bump_version("timetable")
+        bump_version("occupancy")
+        invalidate_reports(pairs=marked)
+
+    def delete_model(self, request, obj):
+        marked = self.marked_pairs([obj])
+        super().delete_model(request, obj)
+        self.lessons_deleted(marked)
+
+    def delete_queryset(self, request, queryset):
+        marked = self.marked_pairs(queryset)
+        super().delete_queryset(request, queryset)
+        self.lessons_deleted(marked)
+
+class LessonAdmin(LessonsDeletingAdmin):
+    records_lookup = "lesson"
+
+    def save_model(self, request, obj, form, change):
+        # Moving a lesson moves its absent and late marks to another date.
+        moved = change and "date" in form.changed_data
+        marked = flagged_pairs(AttendanceRecord.objects.filter(lesson=obj)) if moved else set()
+        super().save_model(request, obj, form, change)
+        if moved:
+            marked |= flagged_pairs(AttendanceRecord.objects.filter(lesson=obj))
+            refresh_daily_summaries(marked)
+            invalidate_reports(pairs=marked)
+
+class CourseAdmin(LessonsDeletingAdmin):
+    records_lookup = "lesson__course"
+
+class PeriodAdmin(LessonsDeletingAdmin):
+    records_lookup = "lesson__period"
+
+class AcademicYearAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        previous_calendar = SchoolCalendar.load() if change else None
+        super().save_model(request, obj, form, change)
+        if previous_calendar is not None:
+            enqueue_calendar_change(previous_calendar, request.user)
+
+class AttendanceRecordAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_reports(refresh_record_summaries([obj]))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_reports(refresh_record_summaries([obj]))
+
+    def delete_queryset(self, request, queryset):
+        pairs = set(queryset.values_list("student_id", "lesson__date"))
+        marked = flagged_pairs(queryset)
+        super().delete_queryset(request, queryset)
+        refresh_daily_summaries(marked)
+        invalidate_reports(pairs)
+
 admin.site.register(Teacher)
 admin.site.register(Section)
 admin.site.register(Student)
-admin.site.register(Course)
+admin.site.register(Course, CourseAdmin)
 admin.site.register(Enrolment)
-admin.site.register(Period)
+admin.site.register(Period, PeriodAdmin)
 admin.site.register(WeeklySchedule)
 admin.site.register(Classroom)
-admin.site.register(AcademicYear)
+admin.site.register(AcademicYear, AcademicYearAdmin)
 admin.site.register(NonSchoolDay)
-admin.site.register(Lesson)
-admin.site.register(AttendanceRecord)
+admin.site.register(Lesson, LessonAdmin)
+admin.site.register(AttendanceRecord, AttendanceRecordAdmin)
+admin.site.register(Job)
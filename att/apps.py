@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AttConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'att'
+
+    def ready(self):
+        from . import signals
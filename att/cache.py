@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import time
+
+from django.core.cache import cache
+
+
+def version_key(*parts):
+    return "att:version:" + ":".join(str(part) for part in parts)
+
+def get_version(*parts):
+    """Return the current version of the data identified by 'parts'.
+
+    Versions are kept in the cache so that every process sees the same one.
+    A missing version is initialised with the current time, so it never
+    matches a version used before it was evicted."""
+    key = version_key(*parts)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+def bump_version(*parts):
+    """Invalidate everything cached under the current version of 'parts'."""
+    key = version_key(*parts)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import threading
+from collections import defaultdict, namedtuple
+from datetime import date
+
+from .cache import get_version
+from .models import Classroom, Course, Enrolment, Lesson, Period, Student, Teacher, WeeklySchedule
+
+TEACHER = "teacher"
+CLASSROOM = "classroom"
+STUDENT = "student"
+
+# A teacher, classroom or student ('kind', 'resource_id') booked
+# by several courses in the same weekly (iso_weekday, period) slot.
+Conflict = namedtuple("Conflict", ["kind", "resource_id", "iso_weekday", "period_id", "course_ids"])
+
+
+class OccupancyIndex():
+    """In-memory index of the courses that book each teacher, classroom
+    and student in every weekly (iso_weekday, period) slot.
+
+    Teachers come from the courses' teacher, students from their enrolments
+    and slots from the weekly schedules. Weekly schedules have no classroom,
+    so a course books the classrooms of its lessons from today on.
+
+    Build it once with 'load()', or get the process-wide one with
+    'get_occupancy_index()'. Checking a slot is then a dictionary
+    lookup per resource of the course, without queries."""
+
+    def __init__(self, course_teachers, enrolments, course_classrooms, schedules, version=None):
+        self.version = version
+        self.teachers = dict(course_teachers)
+        self.students = defaultdict(list)
+        for course_id, student_id in enrolments:
+            self.students[course_id].append(student_id)
+        self.classrooms = defaultdict(list)
+        for course_id, classroom_id in course_classrooms:
+            self.classrooms[course_id].append(classroom_id)
+        self.schedules = set()
+        # (kind, resource_id, iso_weekday, period_id) -> {course_id, ...}
+        self.booked = defaultdict(set)
+        for course_id, period_id, iso_weekday in schedules:
+            self.add(course_id, period_id, iso_weekday)
+
+    @classmethod
+    def load(cls, version=None):
+        course_teachers = Course.objects.exclude(teacher=None).values_list("id", "teacher_id")
+        enrolments = Enrolment.objects.values_list("course_id", "student_id")
+        course_classrooms = Lesson.objects.filter(date__gte=date.today()).exclude(classroom=None).values_list("course_id", "classroom_id").distinct()
+        schedules = WeeklySchedule.objects.values_list("course_id", "period_id", "iso_weekday")
+        return cls(course_teachers, enrolments.iterator(), course_classrooms, schedules, version)
+
+    def resources(self, course_id):
+        """Yield the (kind, resource_id) pairs booked by a course."""
+        teacher_id = self.teachers.get(course_id)
+        if teacher_id is not None:
+            yield TEACHER, teacher_id
+        for classroom_id in self.classrooms.get(course_id, ()):
+            yield CLASSROOM, classroom_id
+        for student_id in self.students.get(course_id, ()):
+            yield STUDENT, student_id
+
+    def add(self, course_id, period_id, iso_weekday):
+        if (course_id, period_id, iso_weekday) in self.schedules:
+            return
+        self.schedules.add((course_id, period_id, iso_weekday))
+        for kind, resource_id in self.resources(course_id):
+            self.booked[(kind, resource_id, iso_weekday, period_id)].add(course_id)
+
+    def remove(self, course_id, period_id, iso_weekday):
+        if (course_id, period_id, iso_weekday) not in self.schedules:
+            return
+        self.schedules.discard((course_id, period_id, iso_weekday))
+        for kind, resource_id in self.resources(course_id):
+            key = (kind, resource_id, iso_weekday, period_id)
+            self.booked[key].discard(course_id)
+            if not self.booked[key]:
+                del self.booked[key]
+
+    def conflicts(self, course_id, period_id, iso_weekday):
+        """Return the conflicts the course has in the slot,
+        or would have if it were scheduled in it."""
+        conflicts = []
+        for kind, resource_id in self.resources(course_id):
+            others = self.booked.get((kind, resource_id, iso_weekday, period_id))
+            if others and others != {course_id}:
+                conflicts.append(Conflict(kind, resource_id, iso_weekday, period_id, tuple(sorted(others | {course_id}))))
+        return conflicts
+
+    def scan(self):
+        """Return every conflict of the school's timetable."""
+        # A copy of the items, as the process-wide index may be updated
+        # by another thread meanwhile.
+        return [
+            Conflict(kind, resource_id, iso_weekday, period_id, tuple(sorted(course_ids)))
+            for (kind, resource_id, iso_weekday, period_id), course_ids in list(self.booked.items())
+            if len(course_ids) > 1
+        ]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_occupancy_index():
+    """Return the process-wide occupancy index, rebuilding it if the
+    "occupancy" version changed since it was built, or on a new day,
+    as classrooms come from the lessons from today on.
+    It is shared, so callers must not 'add' or 'remove' slots on it
+    but use 'update_occupancy_index'."""
+    global _index
+    version = (get_version("occupancy"), date.today())
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = OccupancyIndex.load(version)
+            index = _index
+    return index
+
+def update_occupancy_index(index, bumps, added=(), removed=()):
+    """Apply the weekly schedules just added and removed to 'index', the
+    process-wide index got before changing them, instead of rebuilding it.
+
+    'bumps' is the number of times the changes bumped the "occupancy"
+    version. If it moved further, something else changed too, and the
+    index is rebuilt. Return the up-to-date index."""
+    current, today = get_version("occupancy"), date.today()
+    with _index_lock:
+        if _index is index and index.version == (current - bumps, today):
+            for slot in removed:
+                index.remove(*slot)
+            for slot in added:
+                index.add(*slot)
+            index.version = (current, today)
+            return index
+    return get_occupancy_index()
+
+def conflicts_to_dicts(conflicts):
+    """Group 'conflicts' by slot and courses, with the names of the
+    courses, period and resources involved, ready to be shown or sent
+    as JSON. Names are read with a query per model."""
+    groups = {}
+    for conflict in conflicts:
+        group = groups.setdefault((conflict.iso_weekday, conflict.period_id, conflict.course_ids), defaultdict(list))
+        group[conflict.kind].append(conflict.resource_id)
+    if not groups:
+        return []
+
+    def names(model, ids):
+        return {obj.id: str(obj) for obj in model.objects.filter(pk__in=set(ids))}
+
+    course_names = names(Course, (course_id for _, _, course_ids in groups for course_id in course_ids))
+    period_names = names(Period, (period_id for _, period_id, _ in groups))
+    resource_names = {
+        kind: names(model, (resource_id for group in groups.values() for resource_id in group[kind]))
+        for kind, model in ((TEACHER, Teacher), (CLASSROOM, Classroom), (STUDENT, Student))
+        if any(group[kind] for group in groups.values())
+    }
+    return [
+        {
+            "iso_weekday": iso_weekday,
+            "period": {"id": period_id, "name": period_names.get(period_id)},
+            "courses": [{"id": course_id, "name": course_names.get(course_id)} for course_id in course_ids],
+        } | {
+            f"{kind}s": sorted(resource_names[kind].get(resource_id, "") for resource_id in group[kind])
+            for kind in (TEACHER, CLASSROOM, STUDENT)
+            if group[kind]
+        }
+        for (iso_weekday, period_id, course_ids), group in sorted(groups.items())
+    ]
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+from datetime import date, timedelta
+
+from django.db.models import Count, Q
+
+from .models import AttendanceRecord, AttendanceStatus
+
+# Changes are looked up this long before the client's version, so that
+# records updated in a transaction that committed late are not missed.
+# Records sent twice are harmless: the client just sets them again.
+CHANGES_OVERLAP = timedelta(seconds=5)
+
+
+def section_period_counts(day: date):
+    """Return the number of records of each status on 'day' by section
+    and period, as {section_id: {period_id: {status: count}}},
+    from a single aggregate query."""
+    rows = AttendanceRecord.objects.filter(lesson__date=day).values("student__section_id", "lesson__period_id").annotate(
+        **{status: Count("id", filter=Q(status=status)) for status in AttendanceStatus.values}
+    ).order_by()
+    counts = {}
+    for row in rows:
+        counts.setdefault(row["student__section_id"], {})[row["lesson__period_id"]] = {status: row[status] for status in AttendanceStatus.values}
+    return counts
+
+def section_day_records(section_id, day: date):
+    """Return the records of the section's students on 'day',
+    with their student, lesson and course, as a single query."""
+    return AttendanceRecord.objects.filter(student__section_id=section_id, lesson__date=day).select_related("student", "lesson__course")
+
+def section_day_grid(section_id, day: date, periods):
+    """Return one row per student of the section with lessons on 'day',
+    holding the student's record for each of 'periods' (None when the
+    student has no lesson in that period), and the version of the grid:
+    the latest 'updated_at' of its records."""
+    rows = {}
+    version = None
+    for record in section_day_records(section_id, day).order_by("student__last_name", "student__first_name", "student_id"):
+        row = rows.setdefault(record.student_id, {"student": record.student, "records_by_period": {}})
+        row["records_by_period"].setdefault(record.lesson.period_id, record)
+        version = max(version, record.updated_at) if version else record.updated_at
+    grid = [
+        {
+            "student": row["student"],
+            "attendance_records": [row["records_by_period"].get(period.id) for period in periods]
+        }
+        for row in rows.values()
+    ]
+    return grid, version
+
+def section_day_changes(section_id, day: date, since):
+    """Return the records of the section's students on 'day' updated after
+    'since' (all of them if it is None), as compact lists, and the new
+    version to ask for changes from.
+
+    Changes are selected by 'updated_at', which the server sets, as offline
+    changes synced late keep an older 'marked_at'."""
+    records = AttendanceRecord.objects.filter(student__section_id=section_id, lesson__date=day)
+    if since is not None:
+        records = records.filter(updated_at__gt=since - CHANGES_OVERLAP)
+    changes = list(records.values_list("student_id", "lesson__period_id", "lesson_id", "status", "minutes_late", "updated_at"))
+    version = max((updated_at for *_, updated_at in changes), default=since)
+    return [list(change[:-1]) for change in changes], version
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import csv
+from itertools import groupby
+from tempfile import SpooledTemporaryFile
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from openpyxl import Workbook
+
+from .models import AttendanceRecord, Period
+from .summary import FLAGGED, day_report_records, students_with_summary
+
+# Number of rows fetched from the database cursor at a time.
+CHUNK_SIZE = 2000
+
+# XLSX files smaller than this are kept in memory, bigger ones spill to disk.
+SPOOL_SIZE = 10 * 1024 * 1024
+
+EXPORT_FORMATS = ("csv", "xlsx")
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class Echo:
+    """File-like object that returns what is written to it,
+    so that csv.writer can be used to produce lines one by one."""
+
+    def write(self, value):
+        return value
+
+def day_report_export_rows(day):
+    """Yield the header and one row per student with any absence or late
+    mark on 'day', holding the student's status for each period."""
+    periods = list(Period.objects.all().order_by("start_time"))
+    yield ["Last name", "First name"] + [period.start_time.strftime("%H:%M") for period in periods]
+    records = day_report_records(day).values_list("student_id", "student__last_name", "student__first_name", "lesson__period_id", "status")
+    for (_, last_name, first_name), student_records in groupby(records.iterator(chunk_size=CHUNK_SIZE), key=lambda record: record[:3]):
+        statuses = {}
+        for *_, period_id, status in student_records:
+            statuses.setdefault(period_id, status)
+        yield [last_name, first_name] + [statuses.get(period.id, "") for period in periods]
+
+def summary_export_rows(from_day, to_day=None):
+    """Yield the header and one row per student with any absence or late
+    mark in [from_day, to_day], with their number of marks."""
+    yield ["Last name", "First name", "Section", "Absent", "Late"]
+    students = students_with_summary(from_day, to_day).values_list(
+        "last_name", "first_name", "section__name", "absent", "late"
+    ).order_by("-absent", "-late", "last_name", "first_name")
+    yield from students.iterator(chunk_size=CHUNK_SIZE)
+
+def attendance_export_rows(records):
+    """Yield the header and one row per attendance record in 'records'."""
+    yield ["Date", "Period", "Last name", "First name", "Section", "Course", "Status", "Minutes late"]
+    rows = records.values_list(
+        "lesson__date", "lesson__period__start_time", "student__last_name", "student__first_name",
+        "student__section__name", "lesson__course__name", "status", "minutes_late"
+    )
+    for d, start_time, *row in rows.iterator(chunk_size=CHUNK_SIZE):
+        yield [d, start_time.strftime("%H:%M"), *row]
+
+def student_export_rows(student_id):
+    """Yield the absent and late attendance records of given student."""
+    records = AttendanceRecord.objects.filter(student_id=student_id, status__in=FLAGGED).order_by("lesson__date", "lesson__period__start_time")
+    return attendance_export_rows(records)
+
+def school_export_rows(from_day, to_day):
+    """Yield the absent and late attendance records of every student
+    in [from_day, to_day]."""
+    records = AttendanceRecord.objects.filter(status__in=FLAGGED, lesson__date__range=(from_day, to_day)).order_by(
+        "lesson__date", "lesson__period__start_time", "student__last_name", "student__first_name", "student_id"
+    )
+    return attendance_export_rows(records)
+
+def csv_response(rows, filename):
+    """Stream 'rows' as a CSV file, producing each line as it is read."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type="text/csv")
+    response["Content-Disposition"] = content_disposition_header(True, f"{filename}.csv")
+    return response
+
+def xlsx_response(rows, filename):
+    """Return 'rows' as an XLSX file.
+
+    The workbook is written in openpyxl's write-only mode, which keeps
+    only the current row in memory, and then served in chunks from a
+    spooled temporary file. XLSX is a zip archive, so unlike CSV it
+    can't be sent before the last row is written."""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(filename[:31])
+    for row in rows:
+        worksheet.append(row)
+    output = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=f"{filename}.xlsx", content_type=XLSX_CONTENT_TYPE)
+
+def export_response(rows, filename, export_format):
+    """Return 'rows' as a downloadable file in 'export_format'."""
+    if export_format == "xlsx":
+        return xlsx_response(rows, filename)
+    return csv_response(rows, filename)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+from datetime import date, timedelta
+from itertools import batched
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import AttendanceRecord, AttendanceStatus, Enrolment, Lesson, Period, WeeklySchedule
+from .reportcache import invalidate_reports
+from .schoolcalendar import SchoolCalendar
+from .summary import flagged_pairs, refresh_daily_summaries
+
+# Number of rows sent to the database in a single INSERT.
+BATCH_SIZE = 1000
+
+
+def lesson_start_datetime(d: date, period: Period):
+    return timezone.datetime(d.year, d.month, d.day, period.start_time.hour, period.start_time.minute)
+
+def build_lesson(ws: WeeklySchedule, d: date):
+    """Return the (unsaved) lesson corresponding to a weekly schedule on date 'd'."""
+    return Lesson(
+        course=ws.course,
+        teacher=ws.course.teacher,
+        period=ws.period,
+        date=d,
+        start_datetime=lesson_start_datetime(d, ws.period)
+    )
+
+def build_lessons(ws: WeeklySchedule, from_date: date, to_date: date, calendar: SchoolCalendar):
+    """Return the (unsaved) lessons corresponding to a weekly schedule
+    on the future school days in the range [from_date, to_date)."""
+    from_date = max(from_date, date.today() + timedelta(days=1))
+    return [build_lesson(ws, d) for d in calendar.weekday_dates(ws.iso_weekday, from_date, to_date)]
+
+def do_generate_attendance_records_for_lessons(lessons):
+    """Generate attendance records for every (saved) lesson in 'lessons'.
+
+    Enrolments are read once for all the lessons' courses and records
+    are inserted in batches of BATCH_SIZE."""
+    students_by_course = defaultdict(list)
+    course_ids = {lesson.course_id for lesson in lessons}
+    enrolments = Enrolment.objects.filter(course_id__in=course_ids).values_list("course_id", "student_id")
+    for course_id, student_id in enrolments.iterator():
+        students_by_course[course_id].append(student_id)
+
+    records = (
+        AttendanceRecord(student_id=student_id, lesson_id=lesson.pk, status=AttendanceStatus.UNREGISTERED)
+        for lesson in lessons
+        for student_id in students_by_course[lesson.course_id]
+    )
+    att_record_num = 0
+    for batch in batched(records, BATCH_SIZE):
+        AttendanceRecord.objects.bulk_create(batch)
+        att_record_num = att_record_num + len(batch)
+    return att_record_num
+
+def do_generate_attendance_records(lesson: Lesson):
+    """Generate attendance records for given lesson."""
+    return do_generate_attendance_records_for_lessons([lesson])
+
+def missing_attendance_records():
+    """Return the (student_id, lesson_id) pairs of students enrolled
+    in a lesson's course who have no attendance record for it."""
+    existing = AttendanceRecord.objects.filter(student=OuterRef("student"), lesson=OuterRef("lesson_id"))
+    return Enrolment.objects.annotate(lesson_id=F("course__lesson")).filter(lesson_id__isnull=False).filter(~Exists(existing)).values_list("student_id", "lesson_id")
+
+def orphaned_attendance_records():
+    """Return the unregistered attendance records of students who are
+    no longer enrolled in the lesson's course.
+    Records already marked are kept for the reports."""
+    enrolled = Enrolment.objects.filter(student=OuterRef("student"), course=OuterRef("lesson__course"))
+    return AttendanceRecord.objects.filter(status=AttendanceStatus.UNREGISTERED).filter(~Exists(enrolled))
+
+def do_reconcile_attendance_records(delete_orphans=False):
+    """Make attendance records match enrolments.
+
+    Missing records are computed with a single join of enrolments against
+    lessons and inserted in batches, ignoring the ones that already exist,
+    so it is safe to run it again at any time.
+    If 'delete_orphans' is set, unregistered records of students no longer
+    enrolled are deleted as well.
+    Return the number of records added and removed."""
+    added = 0
+    removed = 0
+    with transaction.atomic():
+        records = (
+            AttendanceRecord(student_id=student_id, lesson_id=lesson_id, status=AttendanceStatus.UNREGISTERED)
+            for student_id, lesson_id in missing_attendance_records().iterator(chunk_size=BATCH_SIZE)
+        )
+        for batch in batched(records, BATCH_SIZE):
+            AttendanceRecord.objects.bulk_create(batch, ignore_conflicts=True)
+            added = added + len(batch)
+        if delete_orphans:
+            removed, _ = orphaned_attendance_records().delete()
+    return added, removed
+
+def do_generate_all_attendance_records():
+    """Generate an attendance record for every student for every lesson he's enrolled in."""
+    added, _ = do_reconcile_attendance_records()
+    return added
+
+def do_bulk_generate_lessons_and_att_records(lessons):
+    """Insert 'lessons' and their attendance records in batches."""
+    with transaction.atomic():
+        Lesson.objects.bulk_create(lessons, batch_size=BATCH_SIZE)
+        do_generate_attendance_records_for_lessons(lessons)
+    bump_version("timetable")
+    return len(lessons)
+
+def do_generate_lessons_and_att_records(ws: WeeklySchedule, from_date: date, to_date: date, calendar: SchoolCalendar = None):
+    """Generate lessons corresponding to a weekly schedule."""
+    if calendar is None:
+        calendar = SchoolCalendar.load()
+    return do_bulk_generate_lessons_and_att_records(build_lessons(ws, from_date, to_date, calendar))
+
+def do_generate_all_lessons(calendar: SchoolCalendar = None):
+    """Generate the lessons of every weekly schedule for the whole academic year.
+
+    Lessons that already exist are not generated again, so it is safe
+    to run it again at any time."""
+    if calendar is None:
+        calendar = SchoolCalendar.load()
+    course_start = calendar.start_date
+    course_end = calendar.end_date + timedelta(days=1)
+    existing = set(Lesson.objects.filter(date__gt=date.today(), date__lt=course_end).values_list("course_id", "period_id", "date").iterator(chunk_size=BATCH_SIZE))
+    weekly_schedule_set = WeeklySchedule.objects.select_related("course", "course__teacher", "period")
+    lessons = []
+    for ws in weekly_schedule_set.iterator():
+        lessons.extend(lesson for lesson in build_lessons(ws, course_start, course_end, calendar) if (ws.course_id, ws.period_id, lesson.date) not in existing)
+    return do_bulk_generate_lessons_and_att_records(lessons)
+
+def do_delete_lessons(ws: WeeklySchedule, course_start: date, course_end: date):
+    """Delete all lessons scheduled by 'ws' weekly schedule."""
+    lessons = Lesson.objects.filter(course=ws.course).filter(period=ws.period).filter(date__iso_week_day=ws.iso_weekday).filter(date__gte=course_start).filter(date__lte=course_end)
+    marked = flagged_pairs(AttendanceRecord.objects.filter(lesson__in=lessons))
+    lessons.delete()
+    refresh_daily_summaries(marked)
+    bump_version("timetable")
+    invalidate_reports(pairs=marked)
+
+def schedule_filter(slots, weekday_lookup="iso_weekday"):
+    """Return a filter matching the given (course_id, period_id, iso_weekday)
+    weekly schedule slots, on 'weekday_lookup' for the weekday."""
+    return reduce(or_, (Q(course_id=course_id, period_id=period_id, **{weekday_lookup: iso_weekday}) for course_id, period_id, iso_weekday in slots))
+
+def do_update_schedules(added, removed, calendar: SchoolCalendar = None):
+    """Generate the lessons of the 'added' weekly schedules and delete
+    those of the 'removed' ones, given as (course_id, period_id, iso_weekday)
+    slots, in a single transaction.
+
+    Slots are checked against the current weekly schedules, and lessons
+    that already exist are not generated again, so applying the same
+    change twice does nothing. As in 'do_delete_lessons', the lessons
+    of removed schedules are deleted over the whole academic year.
+    Return the number of lessons added and removed."""
+    if calendar is None:
+        calendar = SchoolCalendar.load()
+    course_start = calendar.start_date
+    course_end = calendar.end_date + timedelta(days=1)
+    slots = {tuple(slot) for slot in added} | {tuple(slot) for slot in removed}
+    if not slots:
+        return 0, 0
+
+    with transaction.atomic():
+        schedules = {
+            (ws.course_id, ws.period_id, ws.iso_weekday): ws
+            for ws in WeeklySchedule.objects.filter(schedule_filter(slots)).select_related("course", "course__teacher", "period")
+        }
+        added = [schedules[slot] for slot in slots if slot in schedules]
+        removed = [slot for slot in slots if slot not in schedules]
+
+        removed_num = 0
+        marked = set()
+        if removed:
+            lessons = Lesson.objects.filter(schedule_filter(removed, "date__iso_week_day"), date__gte=course_start, date__lt=course_end)
+            marked = flagged_pairs(AttendanceRecord.objects.filter(lesson__in=lessons))
+            _, deleted = lessons.delete()
+            removed_num = deleted.get(Lesson._meta.label, 0)
+            refresh_daily_summaries(marked)
+
+        lessons = []
+        if added:
+            existing = set(
+                Lesson.objects.filter(schedule_filter([(ws.course_id, ws.period_id, ws.iso_weekday) for ws in added], "date__iso_week_day"), date__gte=course_start, date__lt=course_end)
+                .values_list("course_id", "period_id", "date")
+            )
+            lessons = [
+                lesson
+                for ws in added
+                for lesson in build_lessons(ws, course_start, course_end, calendar)
+                if (ws.course_id, ws.period_id, lesson.date) not in existing
+            ]
+        added_num = do_bulk_generate_lessons_and_att_records(lessons)
+    bump_version("timetable")
+    invalidate_reports(pairs=marked)
+    return added_num, removed_num
+
+def do_update_calendar_dates(added_dates, removed_dates, calendar: SchoolCalendar = None):
+    """Add the lessons of 'added_dates', which became school days,
+    and remove those of 'removed_dates', which stopped being school days.
+
+    Dates are checked against the current calendar, so applying the same
+    change twice does nothing. As in 'build_lessons', lessons are only
+    added from tomorrow on. Records already marked on removed dates are
+    kept, along with their lessons.
+    Return the number of lessons added and removed."""
+    if calendar is None:
+        calendar = SchoolCalendar.load()
+    tomorrow = date.today() + timedelta(days=1)
+    added_dates = sorted(d for d in set(added_dates) if d in calendar and d >= tomorrow)
+    removed_dates = sorted(d for d in set(removed_dates) if d not in calendar)
+    if not added_dates and not removed_dates:
+        return 0, 0
+
+    with transaction.atomic():
+        removed_lessons = Lesson.objects.filter(date__in=removed_dates)
+        AttendanceRecord.objects.filter(lesson__in=removed_lessons, status=AttendanceStatus.UNREGISTERED).delete()
+        removed, _ = removed_lessons.filter(~Exists(AttendanceRecord.objects.filter(lesson=OuterRef("pk")))).delete()
+
+        schedules_by_weekday = defaultdict(list)
+        weekly_schedule_set = WeeklySchedule.objects.filter(iso_weekday__in={d.isoweekday() for d in added_dates}).select_related("course", "course__teacher", "period")
+        for ws in weekly_schedule_set:
+            schedules_by_weekday[ws.iso_weekday].append(ws)
+        existing = {
+            (course_id, period_id, d): lesson_id
+            for lesson_id, course_id, period_id, d in Lesson.objects.filter(date__in=added_dates).values_list("id", "course_id", "period_id", "date")
+        }
+        lessons = [
+            build_lesson(ws, d)
+            for d in added_dates
+            for ws in schedules_by_weekday[d.isoweekday()]
+            if (ws.course_id, ws.period_id, d) not in existing
+        ]
+        added = do_bulk_generate_lessons_and_att_records(lessons)
+        # Lessons kept for their marked records get back the others.
+        records = (
+            AttendanceRecord(student_id=student_id, lesson_id=lesson_id, status=AttendanceStatus.UNREGISTERED)
+            for student_id, lesson_id in missing_attendance_records().filter(lesson_id__in=existing.values())
+        )
+        for batch in batched(records, BATCH_SIZE):
+            AttendanceRecord.objects.bulk_create(batch, ignore_conflicts=True)
+    bump_version("timetable")
+    invalidate_reports(dates=removed_dates)
+    return added, removed
+
+def do_add_enrolment_records(enrolments):
+    """Create the attendance records of the lessons from today on for
+    the given (student_id, course_id) enrolment pairs.
+
+    Lessons are read in a single query and records inserted in batches,
+    ignoring the ones that already exist."""
+    enrolments = list(enrolments)
+    if not enrolments:
+        return 0
+    lessons_by_course = defaultdict(list)
+    lessons = Lesson.objects.filter(course_id__in={course_id for _, course_id in enrolments}, date__gte=date.today()).values_list("course_id", "id")
+    for course_id, lesson_id in lessons.iterator():
+        lessons_by_course[course_id].append(lesson_id)
+
+    records = (
+        AttendanceRecord(student_id=student_id, lesson_id=lesson_id, status=AttendanceStatus.UNREGISTERED)
+        for student_id, course_id in enrolments
+        for lesson_id in lessons_by_course[course_id]
+    )
+    att_record_num = 0
+    for batch in batched(records, BATCH_SIZE):
+        AttendanceRecord.objects.bulk_create(batch, ignore_conflicts=True)
+        att_record_num = att_record_num + len(batch)
+    return att_record_num
+
+def do_remove_enrolment_records(enrolments):
+    """Delete the unregistered attendance records of the lessons from
+    today on for the given (student_id, course_id) enrolment pairs."""
+    enrolments = list(enrolments)
+    if not enrolments:
+        return 0
+    enrolled = reduce(or_, (Q(student_id=student_id, lesson__course_id=course_id) for student_id, course_id in enrolments))
+    removed, _ = AttendanceRecord.objects.filter(enrolled, lesson__date__gte=date.today(), status=AttendanceStatus.UNREGISTERED).delete()
+    invalidate_reports(dates=[date.today()])
+    return removed
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .cache import bump_version
+from .models import Course, Enrolment, Section, Student, Teacher
+from .parsecourse import parse_xls
+
+
+def parse_course_files(files, max_workers=None):
+    """Parse uploaded xls course files in memory.
+
+    Several files are parsed in parallel by a pool of worker processes.
+    Return the parsed course dicts in the order of 'files'."""
+    contents = [f.read() for f in files]
+    if len(contents) <= 1:
+        return [parse_xls(c) for c in contents]
+    context = multiprocessing.get_context("forkserver")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        return list(executor.map(parse_xls, contents))
+
+def import_courses(courses_data):
+    """Create courses and their enrolments from parsed course dicts.
+
+    Teachers and students are resolved with one query each and courses
+    and enrolments are inserted in bulk in a single transaction.
+    Return the number of courses created and a list of problems found."""
+    teachers = {teacher.full_name: teacher for teacher in Teacher.objects.all()}
+    student_emails = {email for course_data in courses_data for email in course_data['students']}
+    student_ids = dict(Student.objects.filter(email__in=student_emails).values_list("email", "id"))
+
+    courses = []
+    course_students = []
+    errors = []
+    for course_data in courses_data:
+        teacher_name = (course_data['teacher'] or '').strip()
+        teacher = teachers.get(teacher_name)
+        if teacher is None:
+            errors.append(f"Couldn't find a teacher called {teacher_name}")
+            continue
+        courses.append(Course(name=f'{course_data["name"]} - {course_data["sections"]}',
+                              level=12,
+                              teacher=teacher,
+                              weekly_sessions=4))
+        missing = [email for email in course_data['students'] if email not in student_ids]
+        if missing:
+            errors.append(f"Couldn't find students with emails {', '.join(missing)}")
+        course_students.append([student_ids[email] for email in course_data['students'] if email in student_ids])
+
+    with transaction.atomic():
+        Course.objects.bulk_create(courses)
+        # New courses have no lessons yet, so there are no attendance records to add.
+        Enrolment.objects.bulk_create(
+            [Enrolment(student_id=student_id, course=course)
+             for course, student_ids_in_course in zip(courses, course_students)
+             for student_id in student_ids_in_course],
+            ignore_conflicts=True
+        )
+    # bulk_create sends no post_save signals.
+    bump_version("timetable")
+    bump_version("occupancy")
+    return len(courses), errors
+
+def bulk_import_teachers(teachers, upsert=False):
+    """Create teachers, and their users, from (email, first_name, last_name) tuples.
+
+    Users get an unusable password, as they log in with their Google account,
+    so no password is hashed. Everything is inserted in bulk in a single
+    transaction. With 'upsert', teachers whose email already has a user are
+    updated instead of failing on the duplicate username.
+    Return the number of teachers created and updated."""
+    teachers = {email.lower(): (first_name, last_name) for email, first_name, last_name in teachers}
+    with transaction.atomic():
+        users = {user.username: user for user in User.objects.filter(username__in=teachers)} if upsert else {}
+        new_users = [User(username=email, email=email, password=make_password(None)) for email in teachers if email not in users]
+        User.objects.bulk_create(new_users)
+        users.update((user.username, user) for user in new_users)
+
+        existing = {teacher.user_id: teacher for teacher in Teacher.objects.filter(user__in=users.values())} if upsert else {}
+        created = []
+        updated = []
+        for email, (first_name, last_name) in teachers.items():
+            user = users[email]
+            teacher = existing.get(user.id)
+            if teacher is None:
+                created.append(Teacher(user=user, first_name=first_name, last_name=last_name))
+            else:
+                teacher.first_name = first_name
+                teacher.last_name = last_name
+                updated.append(teacher)
+        Teacher.objects.bulk_create(created)
+        Teacher.objects.bulk_update(updated, ["first_name", "last_name"])
+    return len(created), len(updated)
+
+def bulk_import_students(students, upsert=False):
+    """Create students from (email, first_name, last_name, section_name) tuples.
+
+    Sections are loaded once and students inserted in bulk in a single
+    transaction. With 'upsert', students whose email already exists are
+    updated instead of duplicated.
+    Return the number of students created and updated."""
+    students = list(students)
+    sections = {section.name: section for section in Section.objects.all()}
+    missing = sorted({section_name for _, _, _, section_name in students if section_name not in sections})
+    if missing:
+        raise Section.DoesNotExist(f"Couldn't find sections {', '.join(missing)}")
+
+    with transaction.atomic():
+        existing = {student.email: student for student in Student.objects.filter(email__in=[email for email, _, _, _ in students])} if upsert else {}
+        created = []
+        updated = []
+        for email, first_name, last_name, section_name in students:
+            student = existing.get(email)
+            if student is None:
+                created.append(Student(email=email, first_name=first_name, last_name=last_name, section=sections[section_name]))
+            else:
+                student.first_name = first_name
+                student.last_name = last_name
+                student.section = sections[section_name]
+                updated.append(student)
+        Student.objects.bulk_create(created)
+        Student.objects.bulk_update(updated, ["first_name", "last_name", "section"])
+    # Bulk operations send no signals.
+    bump_version("students")
+    return len(created), len(updated)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+import traceback
+from datetime import timedelta
+from io import BytesIO
+
+from django.db import connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .generation import build_lessons, do_bulk_generate_lessons_and_att_records, do_delete_lessons, do_generate_all_lessons, do_reconcile_attendance_records
+from .generation import do_update_calendar_dates, do_update_schedules
+from .importers import import_courses, parse_course_files
+from .models import Job, JobAttachment, JobStatus, Lesson, WeeklySchedule
+from .schoolcalendar import SchoolCalendar, calendar_diff
+
+# Job handlers by job name. A handler takes the job and returns
+# a JSON serialisable result.
+JOB_HANDLERS = {}
+
+
+def job_handler(name):
+    def register(handler):
+        JOB_HANDLERS[name] = handler
+        return handler
+    return register
+
+def enqueue_job(name, arguments=None, lock_key="", attachments=(), user=None):
+    """Queue job 'name' to be run by the 'runjobs' command.
+    'attachments' are (name, content) pairs of files the job reads."""
+    if name not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job '{name}'")
+    with transaction.atomic():
+        job = Job.objects.create(name=name, arguments=arguments or {}, lock_key=lock_key, created_by=user)
+        JobAttachment.objects.bulk_create([JobAttachment(job=job, name=filename, content=content) for filename, content in attachments])
+    return job
+
+def enqueue_calendar_change(previous_calendar: SchoolCalendar, user=None):
+    """Queue the update of the lessons after the academic year
+    changed from 'previous_calendar'."""
+    return enqueue_job("apply-calendar-change", {"previous_calendar": previous_calendar.as_dict()}, lock_key="timetable", user=user)
+
+def job_to_dict(job):
+    return {
+        "id": job.id,
+        "name": job.name,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "result": job.result,
+        "url": reverse("att:job-status", args=[job.id])
+    }
+
+def report_progress(job, done, total, message=""):
+    """Record that 'done' out of 'total' steps of 'job' are finished."""
+    progress = 100 * done // total if total else 0
+    Job.objects.filter(pk=job.pk).update(progress=progress, message=message[:200])
+
+def claim_next_job():
+    """Mark the oldest runnable queued job as running and return it,
+    or None if there is none.
+
+    A job can't run while an older job with the same lock key is queued
+    or running. The claim is a conditional update, so several workers
+    never run the same job."""
+    blocked = Job.objects.filter(lock_key=OuterRef("lock_key"), id__lt=OuterRef("id"), status__in=[JobStatus.QUEUED, JobStatus.RUNNING])
+    runnable = Job.objects.filter(status=JobStatus.QUEUED).filter(Q(lock_key="") | ~Exists(blocked)).order_by("id")
+    while True:
+        job = runnable.first()
+        if job is None:
+            return None
+        if Job.objects.filter(pk=job.pk, status=JobStatus.QUEUED).update(status=JobStatus.RUNNING, started_at=timezone.now()):
+            job.status = JobStatus.RUNNING
+            return job
+
+def run_job(job_id):
+    """Run the job with given id and record its result or error."""
+    try:
+        job = Job.objects.get(pk=job_id)
+        try:
+            result = JOB_HANDLERS[job.name](job)
+        except Exception as e:
+            Job.objects.filter(pk=job.pk).update(status=JobStatus.FAILED, message=str(e)[:200], error=traceback.format_exc(), finished_at=timezone.now())
+        else:
+            Job.objects.filter(pk=job.pk).update(status=JobStatus.DONE, progress=100, result=result, finished_at=timezone.now())
+    finally:
+        connections.close_all()
+
+def fail_running_job(job, message):
+    """Mark a job as failed if it is still running, for when
+    the worker process running it couldn't record its failure."""
+    Job.objects.filter(pk=job.pk, status=JobStatus.RUNNING).update(status=JobStatus.FAILED, message=message[:200], finished_at=timezone.now())
+
+def fail_interrupted_jobs():
+    """Mark the jobs left running by a worker that stopped as failed."""
+    return Job.objects.filter(status=JobStatus.RUNNING).update(status=JobStatus.FAILED, message="Interrupted", finished_at=timezone.now())
+
+def delete_old_jobs(days=30):
+    """Delete the finished jobs, and their attachments, older than 'days' days."""
+    deleted, _ = Job.objects.filter(status__in=[JobStatus.DONE, JobStatus.FAILED], finished_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
+
+
+@job_handler("generate-lessons")
+def generate_lessons_job(job):
+    report_progress(job, 0, 1, "Generating lessons")
+    return {"lesson_num": do_generate_all_lessons()}
+
+@job_handler("reconcile-attendance-records")
+def reconcile_attendance_records_job(job):
+    report_progress(job, 0, 1, "Reconciling attendance records")
+    added, removed = do_reconcile_attendance_records(delete_orphans=job.arguments.get("delete_orphans", False))
+    return {"att_record_num": added, "att_record_removed_num": removed}
+
+@job_handler("import-courses")
+def import_courses_job(job):
+    attachments = list(job.attachments.order_by("id"))
+    report_progress(job, 0, 2, f"Parsing {len(attachments)} files")
+    courses_data = parse_course_files(BytesIO(bytes(attachment.content)) for attachment in attachments)
+    report_progress(job, 1, 2, "Importing courses")
+    course_num, errors = import_courses(courses_data)
+    return {"course_num": course_num, "errors": errors}
+
+@job_handler("schedule-lessons")
+def schedule_lessons_job(job):
+    """Generate or delete the lessons of a weekly schedule
+    toggled in the timetable."""
+    schedule = WeeklySchedule(course_id=job.arguments["course"], period_id=job.arguments["period"], iso_weekday=job.arguments["iso_weekday"])
+    calendar = SchoolCalendar.load()
+    course_start = calendar.start_date
+    course_end = calendar.end_date + timedelta(days=1)
+    if job.arguments["action"] == "delete":
+        report_progress(job, 0, 1, "Deleting lessons")
+        do_delete_lessons(schedule, course_start, course_end)
+        return {"lesson_num": 0}
+    report_progress(job, 0, 1, "Generating lessons")
+    # An earlier job may have generated some of them already.
+    existing = set(Lesson.objects.filter(course_id=schedule.course_id, period_id=schedule.period_id, date__iso_week_day=schedule.iso_weekday).values_list("date", flat=True))
+    lessons = [lesson for lesson in build_lessons(schedule, course_start, course_end, calendar) if lesson.date not in existing]
+    return {"lesson_num": do_bulk_generate_lessons_and_att_records(lessons)}
+
+@job_handler("update-schedules")
+def update_schedules_job(job):
+    """Generate and delete the lessons of the weekly schedules
+    changed at once in the timetable editor."""
+    added, removed = job.arguments["added"], job.arguments["removed"]
+    report_progress(job, 0, 1, f"Updating lessons of {len(added) + len(removed)} weekly schedules")
+    added_num, removed_num = do_update_schedules(added, removed)
+    return {"lesson_num": added_num, "lesson_removed_num": removed_num}
+
+@job_handler("apply-calendar-change")
+def apply_calendar_change_job(job):
+    """Add and remove the lessons of the dates that entered
+    or left the school calendar."""
+    calendar = SchoolCalendar.load()
+    added_dates, removed_dates = calendar_diff(SchoolCalendar.from_dict(job.arguments["previous_calendar"]), calendar)
+    report_progress(job, 0, 1, f"Updating lessons of {len(added_dates) + len(removed_dates)} days")
+    added, removed = do_update_calendar_dates(added_dates, removed_dates, calendar)
+    return {"lesson_num": added, "lesson_removed_num": removed}
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+import json
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from att import views
+from att.cache import bump_version
+from att.generation import do_generate_all_lessons
+from att.importers import import_courses
+from att.models import AttendanceRecord, AttendanceStatus, Course, Lesson, Student
+from att.reportcache import invalidate_reports
+
+# A benchmark is reported as a regression when its median gets this much
+# slower, by at least MIN_SLOWDOWN_MS so that noise on fast paths is ignored.
+SLOWDOWN_THRESHOLD = 1.2
+MIN_SLOWDOWN_MS = 5
+# Medians that key paths must stay under, whatever the previous results.
+TARGETS_MS = {"search_student": 5}
+
+
+def rolled_back(fn):
+    """Run 'fn' in a transaction that is rolled back, so that benchmarks
+    writing to the database leave it as it was."""
+    def run():
+        with transaction.atomic():
+            result = fn()
+            transaction.set_rollback(True)
+        return result
+    return run
+
+def benchmarks(user):
+    """Return a function emptying the caches the benchmarks use and
+    (name, function) pairs of the key paths to benchmark, on the lessons
+    of 'user' and on the last school day before today."""
+    factory = RequestFactory()
+
+    def get(view, *args, **kwargs):
+        request = factory.get("/")
+        request.user = user
+        return view(request, *args, **kwargs)
+
+    def post_json(view, data):
+        request = factory.post("/", json.dumps(data), content_type="application/json")
+        request.user = user
+        return view(request)
+
+    lesson = Lesson.objects.filter(teacher__user=user, date__lt=timezone.localdate()).order_by("-date", "-period__start_time").first()
+    if lesson is None:
+        raise CommandError("The benchmark user has no past lessons. Seed the database with 'seed_school' first.")
+    day = lesson.date
+    month_ago = day - timedelta(days=30)
+    student = AttendanceRecord.objects.filter(lesson=lesson).select_related("student").first().student
+    records = list(AttendanceRecord.objects.filter(lesson=lesson).values_list("student_id", flat=True))
+    courses_data = [
+        {
+            "name": f"Benchmark {course.name}",
+            "teacher": course.teacher.full_name,
+            "sections": "",
+            "students": list(Student.objects.filter(enrolment__course=course).values_list("email", flat=True))
+        }
+        for course in Course.objects.select_related("teacher").exclude(teacher=None)[:20]
+    ]
+
+    def expire_caches():
+        # Bumping the versions the cached data is keyed by, rather than
+        # clearing a cache shared with the running site.
+        bump_version("timetable")
+        bump_version("occupancy")
+        bump_version("students")
+        invalidate_reports([(student.id, day)])
+
+    return expire_caches, [
+        ("generate_all_lessons", rolled_back(do_generate_all_lessons)),
+        ("report_day", lambda: get(views.report_day, day.year, day.month, day.day)),
+        ("report_from", lambda: get(views.report_from, month_ago.year, month_ago.month, month_ago.day)),
+        ("report_student", lambda: get(views.report_student, student.id)),
+        ("lesson_detail", lambda: get(views.lesson_detail, lesson.id)),
+        ("week_view", lambda: get(views.WeekView.as_view(), year=day.year, month=day.month, day=day.day)),
+        ("student_week", lambda: get(views.StudentWeekView.as_view(), student_id=student.id, year=day.year, month=day.month, day=day.day)),
+        ("search_student", lambda: post_json(views.do_search_students, {"searchstr": student.last_name[:5]})),
+        ("mark_attendance_batch", rolled_back(lambda: post_json(views.mark_attendance_batch, {"changes": [
+            {"studentId": student_id, "lessonId": lesson.id, "status": AttendanceStatus.PRESENT} for student_id in records
+        ]}))),
+        ("import_courses", rolled_back(lambda: import_courses(courses_data))),
+    ]
+
+def run_benchmark(fn, repeat, expire_caches):
+    """Time 'fn' and count its queries, once after 'expire_caches' (cold)
+    and 'repeat' more times (warm)."""
+    expire_caches()
+    runs = []
+    for _ in range(repeat + 1):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = fn()
+            # Template responses are rendered as they would be by the handler.
+            if hasattr(response, "render"):
+                response.render()
+            elapsed = (time.perf_counter() - start) * 1000
+        runs.append((elapsed, len(queries)))
+    (cold_ms, cold_queries), warm = runs[0], runs[1:]
+    warm_ms = [elapsed for elapsed, _ in warm]
+    return {
+        "cold_ms": round(cold_ms, 2),
+        "cold_queries": cold_queries,
+        "min_ms": round(min(warm_ms), 2),
+        "median_ms": round(statistics.median(warm_ms), 2),
+        "max_ms": round(max(warm_ms), 2),
+        "queries": max(query_count for _, query_count in warm)
+    }
+
+def missed_targets(results):
+    """Return descriptions of the benchmarks whose median is over their target."""
+    return [
+        f"{name}: median {results[name]['median_ms']} ms, over the {target} ms target"
+        for name, target in TARGETS_MS.items()
+        if name in results and results[name]["median_ms"] > target
+    ]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def regressions(previous, current):
+    """Return descriptions of the benchmarks that got slower or run
+    more queries than in 'previous' results."""
+    found = []
+    for name, result in current["results"].items():
+        before = previous.get("results", {}).get(name)
+        if before is None:
+            continue
+        if result["median_ms"] > max(before["median_ms"] * SLOWDOWN_THRESHOLD, before["median_ms"] + MIN_SLOWDOWN_MS):
+            found.append(f"{name}: median {before['median_ms']} ms -> {result['median_ms']} ms")
+        if result["queries"] > before["queries"] or result["cold_queries"] > before["cold_queries"]:
+            found.append(f"{name}: queries {before['cold_queries']}/{before['queries']} -> {result['cold_queries']}/{result['queries']} (cold/warm)")
+    return found
+
+
+class Command(BaseCommand):
+    help = "Time and count the queries of the key paths on the current database (seed it with 'seed_school') and write the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5, help="Warm runs of each benchmark.")
+        parser.add_argument("--user", help="Username of the teacher the views are run as. Defaults to the teacher with most lessons.")
+        parser.add_argument("--only", nargs="+", help="Names of the benchmarks to run.")
+        parser.add_argument("--output", help="File the JSON results are written to, instead of stdout.")
+        parser.add_argument("--compare", help="JSON results of a previous run to report regressions against.")
+
+    def handle(self, *args, **options):
+        if options["user"]:
+            user = User.objects.get(username=options["user"])
+        else:
+            user = User.objects.filter(teacher__isnull=False).annotate(lesson_num=Count("teacher__lesson")).order_by("-lesson_num").first()
+            if user is None:
+                raise CommandError("There are no teachers. Seed the database with 'seed_school' first.")
+
+        results = {}
+        expire_caches, paths = benchmarks(user)
+        for name, fn in paths:
+            if options["only"] and name not in options["only"]:
+                continue
+            results[name] = run_benchmark(fn, options["repeat"], expire_caches)
+            self.stderr.write(f"{name}: {results[name]['median_ms']} ms, {results[name]['queries']} queries")
+
+        output = {
+            "commit": git_commit(),
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "dataset": {
+                "students": Student.objects.count(),
+                "lessons": Lesson.objects.count(),
+                "attendance_records": AttendanceRecord.objects.count()
+            },
+            "repeat": options["repeat"],
+            "results": results
+        }
+        text = json.dumps(output, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(text + "\n")
+        else:
+            self.stdout.write(text)
+
+        found = missed_targets(results)
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                found += regressions(json.load(f), output)
+        for regression in found:
+            self.stderr.write(self.style.WARNING(regression))
+        if found:
+            raise CommandError(f"{len(found)} regressions found")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from att.models import AttendanceRecord, AttendanceStatus, Lesson
+from att.summary import students_with_summary
+
+FLAGGED = [AttendanceStatus.ABSENT, AttendanceStatus.LATE]
+
+# Tables that are too big to be scanned sequentially on a year of data.
+LARGE_TABLES = ("att_lesson", "att_attendancerecord", "att_dailyattendancesummary")
+
+
+def hot_path_queries():
+    """Return (name, queryset) pairs reproducing the queries of the
+    attendance hot paths for a sample lesson and student."""
+    lesson = Lesson.objects.exclude(teacher=None).exclude(start_datetime=None).order_by("date").first()
+    record = AttendanceRecord.objects.filter(status__in=FLAGGED).first() or AttendanceRecord.objects.first()
+    if lesson is None or record is None:
+        raise CommandError("There are no lessons or attendance records to explain queries on.")
+    day = lesson.date
+    start_of_week = day - timedelta(days=day.isoweekday() - 1)
+    return [
+        ("lessons-on-day", Lesson.objects.filter(teacher__user=lesson.teacher.user).filter(date=day)),
+        ("week-view", Lesson.objects.filter(teacher=lesson.teacher).filter(date__range=(start_of_week, start_of_week + timedelta(days=6)))),
+        ("next-lesson", Lesson.objects.filter(teacher=lesson.teacher).filter(start_datetime__gt=lesson.start_datetime).order_by("start_datetime")[:1]),
+        ("previous-lesson", Lesson.objects.filter(teacher=lesson.teacher).filter(start_datetime__lt=lesson.start_datetime).order_by("-start_datetime")[:1]),
+        ("delete-schedule", Lesson.objects.filter(course=lesson.course).filter(period=lesson.period).filter(date__iso_week_day=day.isoweekday())),
+        ("lesson-detail", AttendanceRecord.objects.filter(lesson=lesson).select_related("student")),
+        ("mark-unregistered-present", AttendanceRecord.objects.filter(lesson=lesson).filter(status=AttendanceStatus.UNREGISTERED)),
+        ("report-day", AttendanceRecord.objects.filter(lesson__date=day, status__in=FLAGGED).values("student_id")),
+        ("report-student", AttendanceRecord.objects.filter(student_id=record.student_id, status__in=FLAGGED).order_by("lesson__date", "lesson__period__start_time")),
+        ("report-from", students_with_summary(day).order_by("-absent", "-late", "last_name", "first_name")),
+    ]
+
+def sequential_scans(plan):
+    """Return the large tables scanned sequentially in a PostgreSQL plan."""
+    return sorted({table for table in re.findall(r"Seq Scan on (\w+)", plan) if table in LARGE_TABLES})
+
+# Plans depend on the database and on the amount of data, so the command
+# refuses to run on SQLite. Point DATABASE_URL at a PostgreSQL database
+# and seed it with a year of data first:
+#
+#   export DATABASE_URL=postgres://att@localhost/att
+#   python manage.py migrate
+#   python manage.py seed_school
+#   python manage.py explain_hot_paths --analyze
+class Command(BaseCommand):
+    help = "EXPLAIN the queries of the attendance hot paths and check that they use index scans on the large tables. Run it on a PostgreSQL database seeded with a year of data, e.g. with DATABASE_URL=postgres://... after 'migrate' and 'seed_school'."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--analyze", action="store_true", help="Run EXPLAIN ANALYZE instead of EXPLAIN.")
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan, not only the failing ones.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Query plans are only checked on PostgreSQL.")
+
+        failures = []
+        for name, queryset in hot_path_queries():
+            plan = queryset.explain(analyze=options["analyze"])
+            scans = sequential_scans(plan)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: sequential scan on {', '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: ok"))
+            if scans or options["verbose_plans"]:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f"{len(failures)} queries don't use indexes: {', '.join(failures)}")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from att.jobs import claim_next_job, delete_old_jobs, fail_interrupted_jobs, fail_running_job, run_job
+
+
+class Command(BaseCommand):
+    help = "Run the queued background jobs in a pool of worker processes. Run a single instance of it next to the web server."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of jobs run at the same time.")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between checks for new jobs.")
+        parser.add_argument("--once", action="store_true", help="Run the queued jobs and exit when the queue is empty.")
+        parser.add_argument("--keep-days", type=int, default=30, help="Days finished jobs are kept for.")
+
+    def handle(self, *args, **options):
+        interrupted = fail_interrupted_jobs()
+        if interrupted:
+            self.stdout.write(self.style.WARNING(f"{interrupted} jobs left running by a previous worker marked as failed"))
+        delete_old_jobs(options["keep_days"])
+        # Close the connection before the worker processes are started.
+        connections.close_all()
+
+        self.workers = options["workers"]
+        running = {}
+        executor = self.start_pool()
+        try:
+            while True:
+                while len(running) < self.workers and (job := claim_next_job()) is not None:
+                    self.stdout.write(f"Running {job}")
+                    try:
+                        running[executor.submit(run_job, job.id)] = job
+                    except BrokenProcessPool as e:
+                        fail_running_job(job, str(e))
+                        self.stdout.write(self.style.ERROR(f"Failed {job}: {e}"))
+                        executor = self.restart_pool(executor, running)
+                if not running:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                done, _ = wait(running, timeout=options["poll_interval"], return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job = running.pop(future)
+                    if future.exception() is not None:
+                        # The worker process died, so the job couldn't record its failure.
+                        fail_running_job(job, str(future.exception()))
+                        broken = broken or isinstance(future.exception(), BrokenProcessPool)
+                    job.refresh_from_db()
+                    self.stdout.write(f"Finished {job}")
+                if broken:
+                    executor = self.restart_pool(executor, running)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def start_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"), initializer=django.setup)
+
+    def restart_pool(self, executor, running):
+        """Replace a pool broken by a worker process that died,
+        failing the jobs it was still running."""
+        for job in running.values():
+            fail_running_job(job, "A worker process died")
+            self.stdout.write(self.style.ERROR(f"Failed {job}: a worker process died"))
+        running.clear()
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.stdout.write(self.style.WARNING("Restarting the worker processes"))
+        return self.start_pool()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+import random
+from datetime import date, time, timedelta
+from itertools import batched
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from att.cache import bump_version
+from att.generation import build_lesson, do_bulk_generate_lessons_and_att_records
+from att.models import AcademicYear, AttendanceRecord, AttendanceStatus, Course, Enrolment, Lesson, NonSchoolDay, Period, Section, Student, Teacher, WeeklySchedule
+from att.schoolcalendar import SchoolCalendar
+from att.summary import rebuild_daily_summaries
+
+SUBJECTS = ["Mathematics", "Spanish", "English", "Physics", "Chemistry", "Biology", "History", "Geography", "Philosophy", "Physical Education", "Music", "Art", "Technology", "French", "Economics", "Latin"]
+FIRST_NAMES = ["Lucía", "Hugo", "Martina", "Martín", "Sofía", "Pablo", "María", "Mateo", "Julia", "Daniel", "Paula", "Alejandro", "Valeria", "Leo", "Emma", "Manuel", "Daniela", "Álvaro", "Carla", "Adrián", "Sara", "David", "Alba", "Diego", "Noa", "Mario", "Carmen", "Javier", "Elena", "Marco"]
+LAST_NAMES = ["García", "Rodríguez", "González", "Fernández", "López", "Martínez", "Sánchez", "Pérez", "Gómez", "Martín", "Jiménez", "Ruiz", "Hernández", "Díaz", "Moreno", "Muñoz", "Álvarez", "Romero", "Alonso", "Gutiérrez", "Navarro", "Torres", "Domínguez", "Vázquez", "Ramos", "Gil", "Ramírez", "Serrano", "Blanco", "Molina"]
+
+# Number of ids updated per statement when marking attendance.
+MARK_BATCH_SIZE = 900
+
+
+def academic_year_dates(today: date):
+    """Return the first and last days of the academic year 'today' is in,
+    from September to June."""
+    start_year = today.year if today.month >= 9 else today.year - 1
+    return date(start_year, 9, 8), date(start_year + 1, 6, 19)
+
+def nonschool_days(start_date: date, end_date: date):
+    """Return the usual holidays of an academic year."""
+    days = [date(start_date.year, 10, 12), date(start_date.year, 11, 1), date(start_date.year, 12, 8)]
+    days += [date(start_date.year, 12, 22) + timedelta(days=i) for i in range(17)]
+    easter = date(end_date.year, 3, 30)
+    days += [easter + timedelta(days=i) for i in range(10)]
+    days.append(date(end_date.year, 5, 1))
+    return [d for d in days if start_date <= d <= end_date]
+
+def schedule_courses(courses, sections_by_course, slots, rng):
+    """Pick the weekly (iso_weekday, period) slots of every course so that
+    neither a section nor a teacher has two courses at the same time.
+    Sessions are spread over different days when possible."""
+    busy = set()
+    schedules = []
+    for course in courses:
+        section = ("section", sections_by_course[course.id])
+        teacher = ("teacher", course.teacher_id)
+        free = [slot for slot in slots if (section, slot) not in busy and (teacher, slot) not in busy]
+        rng.shuffle(free)
+        chosen = []
+        for slot in free:
+            if len(chosen) < course.weekly_sessions and all(iso_weekday != slot[0] for iso_weekday, _ in chosen):
+                chosen.append(slot)
+        for slot in free:
+            if len(chosen) < course.weekly_sessions and slot not in chosen:
+                chosen.append(slot)
+        for slot in chosen:
+            busy.add((section, slot))
+            busy.add((teacher, slot))
+            schedules.append(WeeklySchedule(course=course, iso_weekday=slot[0], period=slot[1]))
+    return schedules
+
+def mark_attendance(until: date, absent_rate, late_rate, rng):
+    """Mark the records of the lessons up to 'until': most students present,
+    some absent or late at random."""
+    now = timezone.now()
+    past = AttendanceRecord.objects.filter(lesson__date__lte=until)
+    flagged = {AttendanceStatus.ABSENT: [], AttendanceStatus.LATE: []}
+    for record_id in past.values_list("id", flat=True).iterator(chunk_size=10000):
+        draw = rng.random()
+        if draw < absent_rate:
+            flagged[AttendanceStatus.ABSENT].append(record_id)
+        elif draw < absent_rate + late_rate:
+            flagged[AttendanceStatus.LATE].append(record_id)
+    past.update(status=AttendanceStatus.PRESENT, marked_at=now, updated_at=now)
+    for status, record_ids in flagged.items():
+        for batch in batched(record_ids, MARK_BATCH_SIZE):
+            minutes_late = rng.randint(2, 20) if status == AttendanceStatus.LATE else None
+            AttendanceRecord.objects.filter(id__in=batch).update(status=status, minutes_late=minutes_late, updated_at=now)
+    return len(flagged[AttendanceStatus.ABSENT]), len(flagged[AttendanceStatus.LATE])
+
+
+class Command(BaseCommand):
+    help = "Seed an empty database with a synthetic school: sections, teachers, students, courses, enrolments, weekly schedules, a full academic year of lessons and attendance records and random marks up to today."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sections", type=int, default=40, help="Number of sections.")
+        parser.add_argument("--students-per-section", type=int, default=25)
+        parser.add_argument("--courses-per-section", type=int, default=8)
+        parser.add_argument("--weekly-sessions", type=int, default=3, help="Lessons of each course per week.")
+        parser.add_argument("--teachers", type=int, default=None, help="Number of teachers. Defaults to one per 5 courses.")
+        parser.add_argument("--periods", type=int, default=6, help="Periods per day.")
+        parser.add_argument("--absent-rate", type=float, default=0.04)
+        parser.add_argument("--late-rate", type=float, default=0.02)
+        parser.add_argument("--random-seed", type=int, default=0, help="Seed of the random generator, so that runs are reproducible.")
+        parser.add_argument("--flush", action="store_true", help="Delete the existing school data first.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["random_seed"])
+        if options["flush"]:
+            with transaction.atomic():
+                for model in (AttendanceRecord, Lesson, WeeklySchedule, Enrolment, Course, Student, Section, Period, NonSchoolDay, AcademicYear):
+                    model.objects.all().delete()
+                User.objects.filter(teacher__isnull=False).delete()
+        elif Student.objects.exists() or AcademicYear.objects.exists():
+            raise CommandError("The database already has school data. Use --flush to replace it.")
+
+        today = timezone.localdate()
+        start_date, end_date = academic_year_dates(today)
+        section_num = options["sections"]
+        course_num = section_num * options["courses_per_section"]
+        teacher_num = options["teachers"] or max(1, course_num // 5)
+
+        with transaction.atomic():
+            AcademicYear.objects.create(name=f"{start_date.year}-{end_date.year}", start_date=start_date, end_date=end_date)
+            NonSchoolDay.objects.bulk_create([NonSchoolDay(date=d) for d in nonschool_days(start_date, end_date)])
+            periods = Period.objects.bulk_create([
+                Period(name=f"Period {i + 1}", start_time=time(8 + i), end_time=time(8 + i, 55))
+                for i in range(options["periods"])
+            ])
+            sections = Section.objects.bulk_create([
+                Section(name=f"{1 + i % 4}{chr(ord('A') + i // 4)}", level=1 + i % 4)
+                for i in range(section_num)
+            ])
+
+            password = make_password(None)
+            users = User.objects.bulk_create([
+                User(username=f"teacher{i}@school.test", email=f"teacher{i}@school.test", password=password)
+                for i in range(teacher_num)
+            ])
+            teachers = Teacher.objects.bulk_create([
+                Teacher(user=user, first_name=rng.choice(FIRST_NAMES), last_name=f"{rng.choice(LAST_NAMES)} {i}")
+                for i, user in enumerate(users)
+            ])
+
+            students = Student.objects.bulk_create([
+                Student(email=f"student{i}@school.test", first_name=rng.choice(FIRST_NAMES), last_name=f"{rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}", section=sections[i % section_num])
+                for i in range(section_num * options["students_per_section"])
+            ])
+            students_by_section = {}
+            for student in students:
+                students_by_section.setdefault(student.section_id, []).append(student.id)
+
+            courses = []
+            sections_by_course = {}
+            for i in range(course_num):
+                section = sections[i % section_num]
+                subject = SUBJECTS[(i // section_num) % len(SUBJECTS)]
+                courses.append(Course(name=f"{subject} - {section.name}", level=section.level, teacher=teachers[i % teacher_num], weekly_sessions=options["weekly_sessions"]))
+            Course.objects.bulk_create(courses)
+            for i, course in enumerate(courses):
+                sections_by_course[course.id] = sections[i % section_num].id
+            Enrolment.objects.bulk_create(
+                (Enrolment(student_id=student_id, course=course)
+                 for course in courses
+                 for student_id in students_by_section[sections_by_course[course.id]]),
+                batch_size=1000
+            )
+
+            slots = [(iso_weekday, period) for iso_weekday in range(1, 6) for period in periods]
+            schedules = WeeklySchedule.objects.bulk_create(schedule_courses(courses, sections_by_course, slots, rng))
+        self.stdout.write(f"Created {len(teachers)} teachers, {len(students)} students, {len(courses)} courses and {len(schedules)} weekly schedules")
+
+        # Lessons of the whole year, past ones included, unlike do_generate_all_lessons.
+        calendar = SchoolCalendar.load()
+        lessons = [
+            build_lesson(ws, d)
+            for ws in schedules
+            for d in calendar.weekday_dates(ws.iso_weekday, start_date, end_date + timedelta(days=1))
+        ]
+        do_bulk_generate_lessons_and_att_records(lessons)
+        self.stdout.write(f"Created {len(lessons)} lessons and {AttendanceRecord.objects.count()} attendance records")
+
+        with transaction.atomic():
+            absent, late = mark_attendance(today - timedelta(days=1), options["absent_rate"], options["late_rate"], rng)
+            rebuild_daily_summaries()
+        bump_version("students")
+        bump_version("occupancy")
+        self.stdout.write(self.style.SUCCESS(f"Marked attendance up to yesterday: {absent} absent and {late} late"))
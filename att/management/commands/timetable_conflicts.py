@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from att.conflicts import OccupancyIndex, conflicts_to_dicts
+
+
+class Command(BaseCommand):
+    help = "Scan the whole school's weekly timetable for teachers, classrooms and students booked by several courses in the same period."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fail", action="store_true", help="Exit with an error when conflicts are found.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = OccupancyIndex.load()
+        loaded = time.perf_counter()
+        conflicts = index.scan()
+        scanned = time.perf_counter()
+
+        for conflict in conflicts_to_dicts(conflicts):
+            courses = ", ".join(course["name"] for course in conflict["courses"])
+            shared = []
+            for kind in ("teachers", "classrooms", "students"):
+                if kind in conflict:
+                    shared.append(f"{kind} {', '.join(conflict[kind])}")
+            self.stdout.write(f"{conflict['period']['name']}, day {conflict['iso_weekday']}: {courses} share {'; '.join(shared)}")
+        self.stderr.write(f"Loaded {len(index.schedules)} weekly schedules in {(loaded - start) * 1000:.1f} ms and scanned them in {(scanned - loaded) * 1000:.1f} ms")
+
+        if not conflicts:
+            self.stdout.write(self.style.SUCCESS("No conflicts found"))
+        elif options["fail"]:
+            raise CommandError(f"{len(conflicts)} conflicts found")
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(conflicts)} conflicts found"))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AttendanceRecord, AttendanceStatus
+
+
+def record_version(record: AttendanceRecord):
+    """Return the version token of a record: its 'marked_at' timestamp."""
+    return record.marked_at.isoformat()
+
+def parse_version(version):
+    return datetime.fromisoformat(version) if version else None
+
+def record_to_dict(record: AttendanceRecord):
+    return {
+        "studentId": record.student_id,
+        "lessonId": record.lesson_id,
+        "attendanceStatus": record.status,
+        "minutesLate": record.minutes_late,
+        "version": record_version(record)
+    }
+
+def parse_attendance_change(change):
+    """Validate a change as sent by the client and return it as
+    (student_id, lesson_id, status, minutes_late, version)."""
+    status = change["status"]
+    if status not in AttendanceStatus.values:
+        raise ValueError(f"Unknown attendance status {status}")
+    minutes_late = change.get("minutesLate")
+    minutes_late = int(minutes_late) if minutes_late is not None and status == AttendanceStatus.LATE else None
+    return int(change["studentId"]), int(change["lessonId"]), status, minutes_late, parse_version(change.get("version"))
+
+def apply_attendance_changes(changes):
+    """Apply (student_id, lesson_id, status, minutes_late, version) changes
+    in one transaction with a single bulk_update.
+
+    'version' is the 'marked_at' of the record the change was made on.
+    If the record has been marked since, the change is not applied and
+    the record is returned as a conflict. A None version always applies.
+    Return the updated records and the conflicting ones."""
+    changes = list(changes)
+    if not changes:
+        return [], []
+    now = timezone.now()
+    with transaction.atomic():
+        records = AttendanceRecord.objects.select_for_update().filter(
+            student_id__in={student_id for student_id, _, _, _, _ in changes},
+            lesson_id__in={lesson_id for _, lesson_id, _, _, _ in changes}
+        )
+        records = {(record.student_id, record.lesson_id): record for record in records}
+        updated = {}
+        conflicts = {}
+        for student_id, lesson_id, status, minutes_late, version in changes:
+            key = (student_id, lesson_id)
+            record = records.get(key)
+            if record is None:
+                raise AttendanceRecord.DoesNotExist(f"Student {student_id} has no attendance record for lesson {lesson_id}")
+            if key in conflicts or (key not in updated and version is not None and version != record.marked_at):
+                conflicts[key] = record
+                continue
+            record.status = status
+            record.minutes_late = minutes_late
+            record.marked_at = now
+            record.updated_at = now
+            updated[key] = record
+        AttendanceRecord.objects.bulk_update(updated.values(), ["status", "minutes_late", "marked_at", "updated_at"])
+    return list(updated.values()), list(conflicts.values())
+
+def lesson_snapshot(lesson_id):
+    """Return a compact snapshot of a lesson's attendance records with a
+    version token that changes whenever any of them is marked."""
+    records = list(AttendanceRecord.objects.filter(lesson_id=lesson_id).order_by("student_id").values_list("student_id", "status", "minutes_late", "marked_at"))
+    latest = max((marked_at for _, _, _, marked_at in records), default=None)
+    return {
+        "lessonId": lesson_id,
+        "version": f"{latest.isoformat() if latest else ''}/{len(records)}",
+        "records": [[student_id, status, minutes_late, marked_at.isoformat()] for student_id, status, minutes_late, marked_at in records]
+    }
+
+def parse_attendance_delta(delta):
+    """Validate an offline change as sent by the client and return it as
+    (student_id, status, minutes_late, marked_at)."""
+    student_id, _, status, minutes_late, _ = parse_attendance_change({**delta, "lessonId": 0})
+    marked_at = datetime.fromisoformat(delta["markedAt"])
+    if timezone.is_naive(marked_at):
+        raise ValueError("markedAt must include a time zone")
+    return student_id, status, minutes_late, marked_at
+
+def merge_attendance_deltas(lesson_id, deltas):
+    """Merge a log of offline (student_id, status, minutes_late, marked_at)
+    changes into a lesson's records, last writer wins on 'marked_at'.
+
+    Timestamps from the future are clamped to the current time.
+    Return the records updated."""
+    now = timezone.now()
+    latest = {}
+    for student_id, status, minutes_late, marked_at in deltas:
+        marked_at = min(marked_at, now)
+        if student_id not in latest or marked_at >= latest[student_id][2]:
+            latest[student_id] = (status, minutes_late, marked_at)
+    if not latest:
+        return []
+    with transaction.atomic():
+        records = AttendanceRecord.objects.select_for_update().filter(lesson_id=lesson_id, student_id__in=latest)
+        updated = []
+        for record in records:
+            status, minutes_late, marked_at = latest[record.student_id]
+            if marked_at > record.marked_at:
+                record.status = status
+                record.minutes_late = minutes_late
+                record.marked_at = marked_at
+                record.updated_at = now
+                updated.append(record)
+        AttendanceRecord.objects.bulk_update(updated, ["status", "minutes_late", "marked_at", "updated_at"])
+    return updated
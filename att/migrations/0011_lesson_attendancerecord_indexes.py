@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('att', '0010_teacher_landing_url'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['lesson', 'status'], name='att_record_lesson_status'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(condition=models.Q(('status__in', ['absent', 'late'])), fields=['student', 'lesson'], name='att_record_flagged_student'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(condition=models.Q(('status__in', ['absent', 'late'])), fields=['lesson', 'student'], name='att_record_flagged_lesson'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['teacher', 'date'], name='att_lesson_teacher_date'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['teacher', 'start_datetime'], name='att_lesson_teacher_start'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['course', 'period', 'date'], name='att_lesson_course_period_date'),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['date', 'period'], name='att_lesson_date_period'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_daily_summaries(apps, schema_editor):
+    AttendanceRecord = apps.get_model('att', 'AttendanceRecord')
+    DailyAttendanceSummary = apps.get_model('att', 'DailyAttendanceSummary')
+    counts = AttendanceRecord.objects.filter(status__in=['absent', 'late']).values('student_id', 'lesson__date').annotate(
+        absent=Count('id', filter=Q(status='absent')),
+        late=Count('id', filter=Q(status='late'))
+    ).order_by()
+    DailyAttendanceSummary.objects.bulk_create(
+        [DailyAttendanceSummary(student_id=row['student_id'], date=row['lesson__date'], absent=row['absent'], late=row['late']) for row in counts],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('att', '0011_lesson_attendancerecord_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('absent', models.PositiveIntegerField(default=0)),
+                ('late', models.PositiveIntegerField(default=0)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='att.student')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date', 'student'], name='att_summary_date_student')],
+                'unique_together': {('student', 'date')},
+            },
+        ),
+        migrations.RunPython(fill_daily_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:04
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_marked_at(apps, schema_editor):
+    AttendanceRecord = apps.get_model('att', 'AttendanceRecord')
+    AttendanceRecord.objects.update(updated_at=F('marked_at'))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('att', '0013_job_jobattachment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_marked_at, migrations.RunPython.noop),
+    ]
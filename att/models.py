@@ -107,6 +107,14 @@ class Lesson(models.Model):
     classroom = models.ForeignKey(Classroom, null=True, blank=True, on_delete=models.SET_NULL)
     start_datetime = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["teacher", "date"], name="att_lesson_teacher_date"),
+            models.Index(fields=["teacher", "start_datetime"], name="att_lesson_teacher_start"),
+            models.Index(fields=["course", "period", "date"], name="att_lesson_course_period_date"),
+            models.Index(fields=["date", "period"], name="att_lesson_date_period"),
+        ]
+
     def __str__(self):
         return f"{self.course} on {self.date} ({self.period})"
 
@@ -122,9 +130,18 @@ class AttendanceRecord(models.Model):
     status = models.CharField(max_length=20, choices=AttendanceStatus.choices)
     minutes_late = models.PositiveIntegerField(null=True, blank=True)
     marked_at = models.DateTimeField(auto_now_add=True)
+    # Set by the server on every write, whereas offline changes keep the
+    # 'marked_at' of the client. Code updating records in bulk sets it too.
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('student', 'lesson')
+        indexes = [
+            models.Index(fields=["lesson", "status"], name="att_record_lesson_status"),
+            # Only absent and late records show up in the reports.
+            models.Index(fields=["student", "lesson"], condition=models.Q(status__in=["absent", "late"]), name="att_record_flagged_student"),
+            models.Index(fields=["lesson", "student"], condition=models.Q(status__in=["absent", "late"]), name="att_record_flagged_lesson"),
+        ]
 
     # def clean(self):
     #     super().clean()
@@ -142,3 +159,62 @@ class AttendanceRecord(models.Model):
     def __str__(self):
         return f"{self.student} enrolled in {self.lesson}"
 
+
+class DailyAttendanceSummary(models.Model):
+    """Number of absent and late marks of a student on a date.
+    Kept up to date by the code marking attendance, only for dates
+    with any such marks."""
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    date = models.DateField()
+    absent = models.PositiveIntegerField(default=0)
+    late = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('student', 'date')
+        indexes = [
+            models.Index(fields=["date", "student"], name="att_summary_date_student"),
+        ]
+
+    def __str__(self):
+        return f"{self.student} on {self.date}: {self.absent} absent, {self.late} late"
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "queued", "Queued"
+    RUNNING = "running", "Running"
+    DONE = "done", "Done"
+    FAILED = "failed", "Failed"
+
+class Job(models.Model):
+    """Heavy setup operation run in the background by the 'runjobs' command.
+    Jobs with the same non-empty 'lock_key' run one at a time, in order."""
+    name = models.CharField(max_length=50)
+    arguments = models.JSONField(default=dict, blank=True)
+    lock_key = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"], name="att_job_status"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+class JobAttachment(models.Model):
+    """File uploaded with a job, kept in the database
+    so that the worker can read it."""
+    job = models.ForeignKey(Job, related_name="attachments", on_delete=models.CASCADE)
+    name = models.CharField(max_length=200)
+    content = models.BinaryField()
+
+    def __str__(self):
+        return f"{self.name} for {self.job}"
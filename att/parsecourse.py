@@ -1,7 +1,15 @@
 #!/usr/bin/env python
 import csv
+import xlrd
 
 class State(object):
+    """A state of the course sheet scanner.
+
+    States are created once per parser and reused. 'scan' looks at the
+    cells of 'row' from column 'start' on: it either moves the parser to
+    another state and returns the column to resume scanning from,
+    or returns None when the rest of the row is of no interest."""
+
     def __init__(self, parser):
         self.parser = parser
 
@@ -11,85 +19,125 @@ class State(object):
     def __str__(self):
         return self.__class__.__name__
 
-    def on_event(self, event):
-        pass
+    def scan(self, row, start):
+        return None
 
 class FindStudent(State):
-    def on_event(self, event):
-        if event['col'] == self.parser.cols['students_col']:
-            if event['value']:
-                self.parser.add_student(event)
-        return FindStudent(self.parser)
+    def scan(self, row, start):
+        col = self.parser.cols['students_col']
+        value = row[col].strip() if start <= col < len(row) else ''
+        if value:
+            self.parser.add_student(value)
+        elif self.parser.course['students']:
+            # The students column has ended.
+            self.parser.state = None
+        return None
 
 class FindStudentsCol(State):
-    def on_event(self, event):
-        if event['value'] == 'Anotaciones':
-            self.parser.set_students_col(event)
-            return FindStudent(self.parser)
-        return FindStudentsCol(self.parser)
+    def scan(self, row, start):
+        for col in range(start, len(row)):
+            if row[col].strip() == 'Anotaciones':
+                self.parser.set_students_col(col)
+                self.parser.state = self.parser.find_student
+                return col + 1
+        return None
 
 class FindSections(State):
-    def on_event(self, event):
-        if event['col'] == self.parser.cols['subject_col']:
-            if event['value']:
-                self.parser.set_sections(event)
-                return FindStudentsCol(self.parser)
-
-        return FindSections(self.parser)
+    def scan(self, row, start):
+        col = self.parser.cols['subject_col']
+        if start <= col < len(row):
+            value = row[col].strip()
+            if value:
+                self.parser.set_sections(value)
+                self.parser.state = self.parser.find_students_col
+                return col + 1
+        return None
 
 class FindTeacher(State):
-    def on_event(self, event):
-        if event['col'] == self.parser.cols['subject_col']:
-            if event['value']:
-                self.parser.set_teacher(event)
-                return FindSections(self.parser)
-        return FindTeacher(self.parser)
-
+    def scan(self, row, start):
+        col = self.parser.cols['subject_col']
+        if start <= col < len(row):
+            value = row[col].strip()
+            if value:
+                self.parser.set_teacher(value)
+                self.parser.state = self.parser.find_sections
+                return col + 1
+        return None
 
 class FindSubjectName(State):
-    def on_event(self, event):
-        if event['value']:
-            self.parser.set_subject(event)
-            return FindTeacher(self.parser)
-        return FindSubjectName(self.parser)
+    def scan(self, row, start):
+        for col in range(start, len(row)):
+            value = row[col].strip()
+            if value:
+                self.parser.set_subject(value, col)
+                self.parser.state = self.parser.find_teacher
+                return col + 1
+        return None
 
 class FindSubject(State):
-    def on_event(self, event):
-        if event['value'] == 'Materia:':
-            return FindSubjectName(self.parser)
-        return FindSubject(self.parser)
+    def scan(self, row, start):
+        for col in range(start, len(row)):
+            if row[col].strip() == 'Materia:':
+                self.parser.state = self.parser.find_subject_name
+                return col + 1
+        return None
 
 class Parser():
+    """Single-pass scanner extracting a course from the rows of a course sheet.
+
+    Once the subject column is known only that column is looked at, and
+    scanning stops at the first empty cell after the list of students."""
+
     def __init__(self) -> None:
-        self.cols = {'subject_col': None, 'students_col': None}
-        self.course = {'name': None, 'teacher': None, 'sections': [], 'students': []}
-        self.state = FindSubject(self)
+        self.find_subject = FindSubject(self)
+        self.find_subject_name = FindSubjectName(self)
+        self.find_teacher = FindTeacher(self)
+        self.find_sections = FindSections(self)
+        self.find_students_col = FindStudentsCol(self)
+        self.find_student = FindStudent(self)
+        self.reset()
 
-    def set_subject(self, event):
-        self.course['name'] = event['value']
-        self.cols['subject_col'] = event['col']
+    def set_subject(self, value, col):
+        self.course['name'] = value
+        self.cols['subject_col'] = col
 
-    def set_teacher(self, event):
-        self.course['teacher'] = event['value']
+    def set_teacher(self, value):
+        self.course['teacher'] = value
 
-    def set_sections(self, event):
-        self.course['sections'] = event['value']
+    def set_sections(self, value):
+        self.course['sections'] = value
 
-    def set_students_col(self, event):
-        self.cols['students_col'] = event['col']
+    def set_students_col(self, col):
+        self.cols['students_col'] = col
 
-    def add_student(self, event):
-        self.course['students'].append(event['value'])
+    def add_student(self, value):
+        self.course['students'].append(value)
 
     def reset(self):
         self.cols = {'subject_col': None, 'students_col': None}
         self.course = {'name': None, 'teacher': None, 'sections': [], 'students': []}
-        self.state = FindSubject(self)
+        self.state = self.find_subject
+
+    def parse_rows(self, rows):
+        for row in rows:
+            start = 0
+            while start is not None:
+                start = self.state.scan(row, start)
+            if self.state is None:
+                break
+        return self.course
 
     def parse(self, csvfile):
         with open(csvfile, 'r', encoding='utf-8', newline='\n') as f:
-            reader = csv.reader(f)
-            for row_index, row in enumerate(reader):
-                for col_index, field in enumerate(row):
-                    self.state = self.state.on_event({'row': row_index, 'col': col_index, 'value': field.strip()})
-        return self.course
+            return self.parse_rows(csv.reader(f))
+
+def xls_rows(contents):
+    """Iterate over the rows of the first sheet of an xls file's 'contents',
+    with cells converted to strings as they would be written to csv."""
+    sheet = xlrd.open_workbook(file_contents=contents).sheet_by_index(0)
+    for row in range(sheet.nrows):
+        yield [str(value) for value in sheet.row_values(row)]
+
+def parse_xls(contents):
+    """Parse the course in an xls file's 'contents'."""
+    return Parser().parse_rows(xls_rows(contents))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Number of requests per view the percentiles are computed on.
+WINDOW_SIZE = 500
+
+PERCENTILES = (50, 90, 99)
+
+
+def query_budget(queries):
+    """Declare the maximum number of SQL queries a view should run.
+    A warning is logged when the query stats middleware sees it exceeded.
+    On class-based views, set the 'query_budget' attribute instead."""
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+def view_query_budget(view_func):
+    view_class = getattr(view_func, "view_class", None)
+    return getattr(view_class or view_func, "query_budget", None)
+
+def percentile(sorted_values, p):
+    """Return the 'p' percentile of 'sorted_values', by nearest rank."""
+    rank = max(1, -(-p * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+class QueryCounter:
+    """Database execute wrapper adding up the number and duration of queries."""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.queries += 1
+
+
+class QueryStats:
+    """Rolling window of the query count, database time and total time
+    of the last WINDOW_SIZE requests of each view, in this process."""
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.window_size = window_size
+        self.samples = defaultdict(lambda: deque(maxlen=self.window_size))
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    def record(self, view_name, queries, db_time, total_time, budget=None):
+        with self.lock:
+            self.samples[view_name].append((queries, db_time, total_time))
+            if budget is not None:
+                self.budgets[view_name] = budget
+
+    def summary(self):
+        with self.lock:
+            samples = {view_name: list(view_samples) for view_name, view_samples in self.samples.items()}
+            budgets = dict(self.budgets)
+        views = {}
+        for view_name, view_samples in sorted(samples.items()):
+            queries, db_times, total_times = (sorted(values) for values in zip(*view_samples))
+            views[view_name] = {
+                "requests": len(view_samples),
+                "budget": budgets.get(view_name),
+                "queries": {f"p{p}": percentile(queries, p) for p in PERCENTILES} | {"max": queries[-1]},
+                "db_ms": {f"p{p}": round(percentile(db_times, p) * 1000, 1) for p in PERCENTILES} | {"max": round(db_times[-1] * 1000, 1)},
+                "total_ms": {f"p{p}": round(percentile(total_times, p) * 1000, 1) for p in PERCENTILES} | {"max": round(total_times[-1] * 1000, 1)}
+            }
+        return {"pid": os.getpid(), "window_size": self.window_size, "views": views}
+
+query_stats = QueryStats()
+
+
+class QueryStatsMiddleware:
+    """Record the number of SQL queries, the database time and the total
+    time of every request, by resolved URL name.
+
+    The timings are sent in a Server-Timing header, where 'app' is the time
+    spent outside the database, mostly in the view and template rendering.
+    Enabled with the QUERY_STATS setting."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, "QUERY_STATS", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        total_time = time.perf_counter() - start
+
+        match = request.resolver_match
+        if match is None:
+            return response
+        view_name = match.view_name
+        budget = view_query_budget(match.func)
+        query_stats.record(view_name, counter.queries, counter.duration, total_time, budget)
+        if budget is not None and counter.queries > budget:
+            logger.warning("%s ran %d queries, over its budget of %d (%s)", view_name, counter.queries, budget, request.path)
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={counter.duration * 1000:.1f};desc="{counter.queries} queries"',
+            f"app;dur={(total_time - counter.duration) * 1000:.1f}",
+            f"total;dur={total_time * 1000:.1f}"
+        ])
+        return response
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+from django.core.cache import cache
+
+from .cache import bump_version, get_version
+
+# Cached reports are invalidated through version counters;
+# the timeout only bounds how long unused reports are kept.
+REPORT_TIMEOUT = 60 * 60 * 24
+
+
+def cached_report(name, args, versions, build):
+    """Return the report 'name' for 'args', calling 'build' only if it
+    isn't cached for the current 'versions' of the data it depends on."""
+    key = f"att:report:{name}:{':'.join(str(arg) for arg in args)}:{':'.join(str(version) for version in versions)}"
+    report = cache.get(key)
+    if report is None:
+        report = build()
+        cache.set(key, report, REPORT_TIMEOUT)
+    return report
+
+def day_version(d):
+    return get_version("attendance-day", d.isoformat())
+
+def student_version(student_id):
+    return get_version("attendance-student", student_id)
+
+def attendance_version():
+    return get_version("attendance")
+
+def invalidate_reports(pairs=(), dates=()):
+    """Invalidate the reports affected by attendance changes
+    to the given (student_id, date) pairs and to whole 'dates'."""
+    pairs = set(pairs)
+    for d in {d for _, d in pairs} | set(dates):
+        bump_version("attendance-day", d.isoformat())
+    for student_id in {student_id for student_id, _ in pairs}:
+        bump_version("attendance-student", student_id)
+    bump_version("attendance")
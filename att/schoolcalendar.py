@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+from bisect import bisect_left
+from datetime import date, timedelta
+
+from .models import AcademicYear, NonSchoolDay
+
+
+def weekdayrange(from_date: date, to_date: date, iso_weekday, filter_fn=None):
+    """
+    Iterates over all days with given iso_weekday,
+    in the range [from_date, to_date) for which filter_fn returns True.
+    """
+    days_ahead = (iso_weekday - from_date.isoweekday()) % 7
+    current = from_date + timedelta(days=days_ahead)
+    while current < to_date:
+        if filter_fn is None or filter_fn(current):
+            yield current
+        current += timedelta(days=7)
+
+class SchoolCalendar():
+    """In-memory snapshot of the school calendar: the days of the
+    academic year that are not non-school days.
+
+    Build it once with 'load()' and reuse it for a whole generation run
+    or request instead of querying the database for every date."""
+
+    def __init__(self, start_date: date, end_date: date, nonschool_days=()):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.nonschool_days = frozenset(nonschool_days)
+        self._school_days_by_weekday = {}
+
+    @classmethod
+    def load(cls):
+        academic_year = AcademicYear.objects.all()[0]
+        nonschool_days = NonSchoolDay.objects.filter(date__range=(academic_year.start_date, academic_year.end_date)).values_list("date", flat=True)
+        return cls(academic_year.start_date, academic_year.end_date, nonschool_days)
+
+    def as_dict(self):
+        return {
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "nonschool_days": sorted(d.isoformat() for d in self.nonschool_days)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(date.fromisoformat(data["start_date"]), date.fromisoformat(data["end_date"]), (date.fromisoformat(d) for d in data["nonschool_days"]))
+
+    def __contains__(self, d: date):
+        return self.is_school_day(d)
+
+    def is_school_day(self, d: date):
+        return (self.start_date <= d <= self.end_date) and (d not in self.nonschool_days)
+
+    def school_days(self, iso_weekday):
+        """Return the sorted list of school days with given iso_weekday."""
+        days = self._school_days_by_weekday.get(iso_weekday)
+        if days is None:
+            days = list(weekdayrange(self.start_date, self.end_date + timedelta(days=1), iso_weekday, filter_fn=self.is_school_day))
+            self._school_days_by_weekday[iso_weekday] = days
+        return days
+
+    def weekday_dates(self, iso_weekday, from_date: date, to_date: date):
+        """Return the school days with given iso_weekday in the range [from_date, to_date)."""
+        days = self.school_days(iso_weekday)
+        return days[bisect_left(days, from_date):bisect_left(days, to_date)]
+
+def calendar_diff(old: SchoolCalendar, new: SchoolCalendar):
+    """Return the sorted lists of dates that became school days and
+    of dates that stopped being school days from 'old' to 'new'."""
+    added = []
+    removed = []
+    current = min(old.start_date, new.start_date)
+    end = max(old.end_date, new.end_date)
+    while current <= end:
+        was_school_day = current in old
+        is_school_day = current in new
+        if is_school_day and not was_school_day:
+            added.append(current)
+        elif was_school_day and not is_school_day:
+            removed.append(current)
+        current += timedelta(days=1)
+    return added, removed
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import threading
+from bisect import bisect_right
+
+from rapidfuzz import fuzz, process, utils
+
+from .cache import get_version
+from .models import Student
+
+# Scoring every name with WRatio is too slow for a search on each keystroke.
+# The best WRatio scores of a few candidates, picked with the cheap QRatio
+# scorer and by containing every word of the search, give a score the
+# results must reach, so that most names can be skipped or cut short.
+QRATIO_CANDIDATES = 200
+SUBSTRING_CANDIDATES = 300
+# rapidfuzz rounds score cutoffs, so they are lowered by this much
+# not to drop names scoring exactly the cutoff.
+CUTOFF_MARGIN = 0.01
+# WRatio scores a name at least 1.5 times as long as the search, or as short,
+# at most 80 with 'ratio', 85.5 with 'partial_token_ratio' and 90 with
+# 'partial_ratio', going over 89.9 only when one contains the other.
+CONTAINED_SCORE = 89.9
+
+class StudentSearchIndex():
+    """Students' "last, first" names, preprocessed once for rapidfuzz,
+    together with their ids."""
+
+    def __init__(self, students, version=None):
+        self.version = version
+        self.student_ids = []
+        self.names = []
+        for student_id, last_name, first_name in students:
+            self.student_ids.append(student_id)
+            self.names.append(f"{last_name}, {first_name}")
+        self.choices = [utils.default_process(name) for name in self.names]
+        # All the choices in one string, to find words in them with str.find.
+        self.text = "\n".join(self.choices)
+        self.offsets = []
+        offset = 0
+        for choice in self.choices:
+            self.offsets.append(offset)
+            offset += len(choice) + 1
+        # Choice indexes by length, to find the ones up to a length.
+        self.by_length = sorted(range(len(self.choices)), key=lambda index: len(self.choices[index]))
+        self.lengths = [len(self.choices[index]) for index in self.by_length]
+
+    @classmethod
+    def load(cls, version=None):
+        students = Student.objects.order_by("last_name", "first_name").values_list("id", "last_name", "first_name")
+        return cls(students, version)
+
+    def extract(self, searchstr, limit=10):
+        """Return the 'limit' best matches for 'searchstr'
+        as (name, score, index, student_id) tuples,
+        the same as scoring every name with WRatio."""
+        query = utils.default_process(searchstr)
+        candidates = {index for _, _, index in process.extract(query, self.choices, scorer=fuzz.QRatio, processor=None, limit=QRATIO_CANDIDATES)}
+        candidates.update(self.containing(query.split(), SUBSTRING_CANDIDATES))
+        candidates = sorted(candidates)
+        best = process.extract(query, [self.choices[index] for index in candidates], scorer=fuzz.WRatio, processor=None, limit=limit)
+        # No name outside the 'limit' best scores less than the candidates' worst.
+        cutoff = max(best[-1][1] - CUTOFF_MARGIN, 0) if len(best) == limit else 0
+        if cutoff > CONTAINED_SCORE:
+            # Only names not much longer than the search, or containing it, can score that much.
+            indexes = set(self.by_length[:bisect_right(self.lengths, (3 * len(query) - 1) // 2)])
+            indexes.update(self.containing([query]))
+            indexes = sorted(indexes)
+        else:
+            indexes = range(len(self.choices))
+        matches = process.extract(query, [self.choices[index] for index in indexes], scorer=fuzz.WRatio, processor=None, limit=limit, score_cutoff=cutoff)
+        return [(self.names[indexes[i]], score, indexes[i], self.student_ids[indexes[i]]) for _, score, i in matches]
+
+    def containing(self, words, limit=None):
+        """Return the indexes of up to 'limit' choices containing all 'words'."""
+        if not words:
+            return []
+        first, *rest = sorted(words, key=len, reverse=True)
+        found = []
+        position = self.text.find(first)
+        while position != -1 and (limit is None or len(found) < limit):
+            index = bisect_right(self.offsets, position) - 1
+            if all(word in self.choices[index] for word in rest):
+                found.append(index)
+            position = self.text.find(first, self.offsets[index] + len(self.choices[index]))
+        return found
+
+    def extract_one(self, searchstr):
+        matches = self.extract(searchstr, limit=1)
+        if not matches:
+            raise LookupError("There are no students to search")
+        return matches[0]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_student_search_index():
+    """Return the process-wide student search index,
+    rebuilding it if students changed since it was built."""
+    global _index
+    version = get_version("students")
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = StudentSearchIndex.load(version)
+            index = _index
+    return index
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .generation import do_add_enrolment_records, do_remove_enrolment_records, do_update_calendar_dates
+from .models import Classroom, Course, Enrolment, Lesson, NonSchoolDay, Period, Student, Teacher, WeeklySchedule
+
+# (student_id, course_id) pairs whose records the current thread removed already.
+_removed = threading.local()
+
+@contextmanager
+def enrolment_records_removed(enrolments):
+    """Make deleting the given (student_id, course_id) enrolments skip
+    removing their records, for callers that removed them in bulk."""
+    _removed.pairs = set(enrolments)
+    try:
+        yield
+    finally:
+        del _removed.pairs
+
+@receiver(post_save, sender=Enrolment)
+def enrolment_saved(sender, instance, created, raw=False, **kwargs):
+    """Give a newly enrolled student the records of the course's remaining lessons."""
+    if created and not raw:
+        do_add_enrolment_records([(instance.student_id, instance.course_id)])
+
+@receiver(post_delete, sender=Enrolment)
+def enrolment_deleted(sender, instance, **kwargs):
+    """Remove the unregistered records of the course's remaining lessons."""
+    if (instance.student_id, instance.course_id) not in getattr(_removed, "pairs", ()):
+        do_remove_enrolment_records([(instance.student_id, instance.course_id)])
+
+@receiver(pre_save, sender=NonSchoolDay)
+def nonschool_day_saving(sender, instance, raw=False, **kwargs):
+    """Remember the date a non-school day had before being changed."""
+    if not raw and instance.pk is not None:
+        instance._previous_date = NonSchoolDay.objects.filter(pk=instance.pk).values_list("date", flat=True).first()
+
+@receiver(post_save, sender=NonSchoolDay)
+def nonschool_day_saved(sender, instance, raw=False, **kwargs):
+    """Remove the lessons of the new non-school day and,
+    if its date changed, give the previous date back its lessons."""
+    if not raw:
+        previous_date = getattr(instance, "_previous_date", None)
+        do_update_calendar_dates([previous_date] if previous_date else [], [instance.date])
+
+@receiver(post_delete, sender=NonSchoolDay)
+def nonschool_day_deleted(sender, instance, **kwargs):
+    """Give the date back its lessons."""
+    do_update_calendar_dates([instance.date], [])
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def student_changed(sender, **kwargs):
+    """Rebuild the student search index on next use."""
+    bump_version("students")
+
+@receiver(post_save, sender=Enrolment)
+@receiver(post_delete, sender=Enrolment)
+@receiver(post_save, sender=WeeklySchedule)
+@receiver(post_delete, sender=WeeklySchedule)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Classroom)
+def occupancy_changed(sender, **kwargs):
+    """Rebuild the occupancy index on next use.
+    Views changing weekly schedules update it in place instead."""
+    bump_version("occupancy")
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=WeeklySchedule)
+@receiver(post_delete, sender=WeeklySchedule)
+@receiver(post_save, sender=Period)
+@receiver(post_delete, sender=Period)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Teacher)
+@receiver(post_delete, sender=Teacher)
+def timetable_changed(sender, **kwargs):
+    """Invalidate cached week grids.
+    Lessons get no post_delete receiver so that deleting them in bulk
+    stays fast: code deleting lessons bumps the version itself."""
+    bump_version("timetable")
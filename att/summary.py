@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+from functools import reduce
+from itertools import batched
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .models import AttendanceRecord, AttendanceStatus, DailyAttendanceSummary, Lesson, Student
+
+FLAGGED = [AttendanceStatus.ABSENT, AttendanceStatus.LATE]
+
+# Number of (student, date) pairs refreshed per statement.
+BATCH_SIZE = 500
+
+
+def daily_counts(records):
+    """Group absent and late 'records' by student and date."""
+    return records.filter(status__in=FLAGGED).values("student_id", "lesson__date").annotate(
+        absent=Count("id", filter=Q(status=AttendanceStatus.ABSENT)),
+        late=Count("id", filter=Q(status=AttendanceStatus.LATE))
+    ).order_by()
+
+def refresh_daily_summaries(pairs):
+    """Recompute the summaries of the given (student_id, date) pairs
+    from their attendance records."""
+    pairs = set(pairs)
+    with transaction.atomic():
+        for batch in batched(pairs, BATCH_SIZE):
+            records = AttendanceRecord.objects.filter(reduce(or_, (Q(student_id=student_id, lesson__date=d) for student_id, d in batch)))
+            DailyAttendanceSummary.objects.filter(reduce(or_, (Q(student_id=student_id, date=d) for student_id, d in batch))).delete()
+            DailyAttendanceSummary.objects.bulk_create([
+                DailyAttendanceSummary(student_id=row["student_id"], date=row["lesson__date"], absent=row["absent"], late=row["late"])
+                for row in daily_counts(records)
+            ])
+
+def flagged_pairs(records):
+    """Return the (student_id, date) pairs of the absent and late 'records'."""
+    return set(records.filter(status__in=FLAGGED).values_list("student_id", "lesson__date").distinct())
+
+def refresh_record_summaries(records):
+    """Recompute the summaries affected by changes to 'records'.
+    Return the affected (student_id, date) pairs."""
+    lesson_ids = {record.lesson_id for record in records}
+    dates = dict(Lesson.objects.filter(pk__in=lesson_ids).values_list("id", "date"))
+    pairs = {(record.student_id, dates[record.lesson_id]) for record in records}
+    refresh_daily_summaries(pairs)
+    return pairs
+
+def rebuild_daily_summaries():
+    """Recompute every summary from the attendance records."""
+    with transaction.atomic():
+        DailyAttendanceSummary.objects.all().delete()
+        DailyAttendanceSummary.objects.bulk_create(
+            (DailyAttendanceSummary(student_id=row["student_id"], date=row["lesson__date"], absent=row["absent"], late=row["late"])
+             for row in daily_counts(AttendanceRecord.objects.all()).iterator()),
+            batch_size=1000
+        )
+
+def students_with_summary(from_day, to_day=None):
+    """Return students with any absent or late marks in [from_day, to_day],
+    annotated with their number of 'absent' and 'late' marks."""
+    window = Q(dailyattendancesummary__date__gte=from_day)
+    if to_day is not None:
+        window &= Q(dailyattendancesummary__date__lte=to_day)
+    return Student.objects.filter(window).annotate(
+        absent=Sum("dailyattendancesummary__absent"),
+        late=Sum("dailyattendancesummary__late")
+    )
+
+def day_report_records(day):
+    """Return every record on 'day' of the students with any absent or late
+    mark on it, ordered by student and then by period."""
+    flagged_students = AttendanceRecord.objects.filter(lesson__date=day, status__in=FLAGGED).values("student_id")
+    return AttendanceRecord.objects.filter(lesson__date=day, student_id__in=flagged_students).order_by(
+        "student__last_name", "student__first_name", "student_id", "lesson__period__start_time"
+    )
@@ -1,3 +1,614 @@
-from django.test import TestCase
+import json
+import random
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rapidfuzz import fuzz, process, utils
+
+from .conflicts import STUDENT, get_occupancy_index
+from .generation import do_generate_all_lessons, do_update_calendar_dates, do_update_schedules
+from .importers import bulk_import_students, bulk_import_teachers
+from .management.commands.seed_school import FIRST_NAMES, LAST_NAMES
+from .marking import apply_attendance_changes, merge_attendance_deltas
+from .models import AcademicYear, AttendanceRecord, AttendanceStatus, Course, DailyAttendanceSummary, Enrolment, Lesson, Period, Section, Student, Teacher, WeeklySchedule
+from .parsecourse import Parser
+from .querystats import query_stats
+from .schoolcalendar import SchoolCalendar, calendar_diff
+from .search import StudentSearchIndex
+from .summary import rebuild_daily_summaries
+from .views import lesson_detail
+from .weekgrid import next_lesson_id, previous_lesson_id
+
+# A Monday of the academic year the tests create, in the past so that
+# nothing is generated for it from today on.
+DAY = date(2024, 10, 7)
+
+
+def create_school(student_num=2, period_num=3, day=DAY):
+    """Create a teacher, a section of 'student_num' students and one course
+    per period, each with a lesson on 'day' and a record for every student.
+    Return the teacher's user, the periods and the lessons."""
+    AcademicYear.objects.create(name="2024-2025", start_date=date(2024, 9, 9), end_date=date(2025, 6, 20))
+    user = User.objects.create_user("teacher@school.test")
+    teacher = Teacher.objects.create(user=user, first_name="Ada", last_name="Lovelace")
+    section = Section.objects.create(name="1A", level=1)
+    periods = [Period.objects.create(name=f"Period {i + 1}", start_time=time(8 + i), end_time=time(8 + i, 55)) for i in range(period_num)]
+    lessons = []
+    for period in periods:
+        course = Course.objects.create(name=f"Course {period.name} - 1A", level=1, teacher=teacher, weekly_sessions=1)
+        lessons.append(Lesson.objects.create(course=course, teacher=teacher, period=period, date=day))
+    add_students(student_num, section, lessons)
+    return user, periods, lessons
+
+def add_students(student_num, section, lessons):
+    """Enrol 'student_num' new students of 'section' in the lessons' courses,
+    with an unregistered record for each lesson."""
+    start = Student.objects.count()
+    students = Student.objects.bulk_create([
+        Student(email=f"student{i}@school.test", first_name="Student", last_name=f"{i:03}", section=section)
+        for i in range(start, start + student_num)
+    ])
+    Enrolment.objects.bulk_create([Enrolment(student=student, course=lesson.course) for student in students for lesson in lessons])
+    AttendanceRecord.objects.bulk_create([
+        AttendanceRecord(student=student, lesson=lesson, status=AttendanceStatus.UNREGISTERED)
+        for student in students
+        for lesson in lessons
+    ])
+    return students
+
+
+class ReportDayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.periods, self.lessons = create_school()
+        AttendanceRecord.objects.filter(lesson=self.lessons[0]).update(status=AttendanceStatus.ABSENT)
+        AttendanceRecord.objects.filter(lesson=self.lessons[1]).update(status=AttendanceStatus.LATE)
+        self.client.force_login(self.user)
+        self.url = reverse("att:report-day", args=[DAY.year, DAY.month, DAY.day])
+
+    def test_report_lists_every_period_of_flagged_students(self):
+        response = self.client.get(self.url)
+        rows = response.context["attendance_records"]
+        self.assertEqual(len(rows), 2)
+        for row in rows:
+            self.assertEqual([record.status for record in row["attendance_records"]], [AttendanceStatus.ABSENT, AttendanceStatus.LATE, AttendanceStatus.UNREGISTERED])
+
+    def test_query_count_does_not_grow_with_students(self):
+        # Session, user, periods and the pivoted records.
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+        section = Section.objects.get()
+        students = add_students(10, section, self.lessons)
+        AttendanceRecord.objects.filter(student__in=students, lesson=self.lessons[2]).update(status=AttendanceStatus.ABSENT)
+        cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["attendance_records"]), 12)
+
+    def test_export_has_the_rows_of_the_report(self):
+        response = self.client.get(reverse("att:export-report-day", args=[DAY.year, DAY.month, DAY.day]))
+        self.assertEqual(response["Content-Disposition"], f'attachment; filename="report-{DAY.isoformat()}.csv"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[1:], [
+            ",".join([row["student"].last_name, row["student"].first_name] + [record.status for record in row["attendance_records"]])
+            for row in self.client.get(self.url).context["attendance_records"]
+        ])
+
+
+
+
+class WeekViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.periods, self.lessons = create_school()
+        self.client.force_login(self.user)
+        self.url = reverse("att:week-view", args=[DAY.year, DAY.month, DAY.day])
+
+    def test_query_count_does_not_grow_with_lessons(self):
+        # Session, user, teacher, periods and the week's lessons.
+        with self.assertNumQueries(5):
+            self.client.get(self.url)
+        teacher = Teacher.objects.get()
+        for i in range(1, 5):
+            for lesson in self.lessons:
+                Lesson.objects.create(course=lesson.course, teacher=teacher, period=lesson.period, date=DAY + timedelta(days=i))
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        self.assertEqual([sum(lesson is not None for _, lesson in lessons) for _, lessons in response.context["lessons_by_day"]], [3] * 5)
+        # The grid is cached: session, user and teacher.
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+
+
+
+class NeighbourLessonTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _, periods, lessons = create_school(student_num=0, period_num=2)
+        teacher = Teacher.objects.get()
+
+        def lesson(period, day):
+            return Lesson.objects.create(
+                course=lessons[0].course, teacher=teacher, period=period, date=day,
+                start_datetime=timezone.make_aware(datetime.combine(day, period.start_time))
+            )
+
+        # The previous Friday, the two periods of DAY and of the day after, and the next Monday.
+        self.lessons = [lesson(periods[1], DAY - timedelta(days=3))]
+        self.lessons += [lesson(period, day) for day in (DAY, DAY + timedelta(days=1)) for period in periods]
+        self.lessons.append(lesson(periods[0], DAY + timedelta(days=7)))
+
+    def test_neighbours_are_the_teachers_lessons_in_order(self):
+        ids = [lesson.id for lesson in self.lessons]
+        self.assertEqual([previous_lesson_id(lesson) for lesson in self.lessons], [None] + ids[:-1])
+        self.assertEqual([next_lesson_id(lesson) for lesson in self.lessons], ids[1:] + [None])
+
+    def test_neighbours_within_the_week_come_from_the_cached_sequence(self):
+        lesson = self.lessons[2]
+        previous_lesson_id(lesson)
+        with self.assertNumQueries(0):
+            self.assertEqual((previous_lesson_id(lesson), next_lesson_id(lesson)), (self.lessons[1].id, self.lessons[3].id))
+        # At the ends of the week, one query past them.
+        with self.assertNumQueries(1):
+            self.assertEqual(previous_lesson_id(self.lessons[1]), self.lessons[0].id)
+
+class StudentWeekViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, self.periods, self.lessons = create_school()
+        self.client.force_login(self.user)
+        self.section = Section.objects.get()
+        self.student = Student.objects.first()
+
+    def test_query_count_does_not_grow_with_lessons(self):
+        url = reverse("att:student-week", args=[self.student.id, DAY.year, DAY.month, DAY.day])
+        # Session, user, student, periods and the week's records.
+        with self.assertNumQueries(5):
+            self.client.get(url)
+        for i in range(1, 5):
+            lessons = [Lesson.objects.create(course=lesson.course, teacher=lesson.teacher, period=lesson.period, date=DAY + timedelta(days=i)) for lesson in self.lessons]
+            AttendanceRecord.objects.bulk_create([AttendanceRecord(student=self.student, lesson=lesson) for lesson in lessons])
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual([sum(record is not None for _, record in records) for _, records in response.context["records_by_day"]], [3] * 5)
+
+    def test_section_week_query_count_does_not_grow_with_students(self):
+        url = reverse("att:section-week", args=[self.section.id, DAY.year, DAY.month, DAY.day])
+        # Session, user, section, periods, the week's records and the students.
+        with self.assertNumQueries(6):
+            self.client.get(url)
+        add_students(10, self.section, self.lessons)
+        # Periods are loaded once per process.
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["students_and_records"]), 12)
+
+
+@override_settings(QUERY_STATS=True)
+class QueryStatsMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user, _, self.lessons = create_school()
+        self.client.force_login(self.user)
+        self.url = reverse("att:lesson-detail", args=[self.lessons[0].id])
+
+    def test_timings_are_sent_and_recorded(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertRegex(response["Server-Timing"], rf'^db;dur=[0-9.]+;desc="{len(queries)} queries", app;dur=[0-9.]+, total;dur=[0-9.]+$')
+        self.assertIn("att:lesson-detail", query_stats.summary()["views"])
+
+    def test_queries_over_the_budget_are_logged(self):
+        add_students(10, Section.objects.get(), self.lessons)
+        with self.assertNoLogs("att.querystats", "WARNING"):
+            self.client.get(self.url)
+        with patch.object(lesson_detail, "query_budget", 1), self.assertLogs("att.querystats", "WARNING") as logs:
+            self.client.get(self.url)
+        self.assertIn("att:lesson-detail ran", logs.output[0])
+
+    @override_settings(QUERY_STATS=False)
+    def test_nothing_is_sent_when_disabled(self):
+        self.assertNotIn("Server-Timing", self.client.get(self.url))
+
+class AdminCascadeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _, _, self.lessons = create_school(student_num=2, period_num=2)
+        AttendanceRecord.objects.filter(lesson=self.lessons[0]).update(status=AttendanceStatus.ABSENT)
+        rebuild_daily_summaries()
+        self.client.force_login(User.objects.create_superuser("admin@school.test"))
+        self.url = reverse("att:report-from", args=[DAY.year, DAY.month, DAY.day])
+
+    def test_deleting_a_course_removes_its_marks_from_the_reports(self):
+        self.assertEqual([student.absent for student in self.client.get(self.url).context["students"]], [1, 1])
+        course = self.lessons[0].course
+        self.client.post(reverse("admin:att_course_delete", args=[course.id]), {"post": "yes"})
+        self.assertFalse(Course.objects.filter(pk=course.id).exists())
+        self.assertEqual(self.client.get(self.url).context["students"], [])
+
+    def test_moving_a_lesson_moves_its_marks(self):
+        lesson = self.lessons[0]
+        moved_to = DAY + timedelta(days=1)
+        self.client.post(reverse("admin:att_lesson_change", args=[lesson.id]), {
+            "course": lesson.course_id, "teacher": lesson.teacher_id, "period": lesson.period_id,
+            "date": moved_to.isoformat(), "classroom": "", "start_datetime_0": "", "start_datetime_1": ""
+        })
+        self.assertEqual(set(DailyAttendanceSummary.objects.values_list("date", flat=True)), {moved_to})
+        self.assertEqual(self.client.get(self.url).context["students"][0].absent, 1)
+
+
+class ApplyAttendanceChangesTests(TestCase):
+    def setUp(self):
+        _, _, self.lessons = create_school(student_num=2, period_num=1)
+        self.lesson = self.lessons[0]
+        self.first, self.second = AttendanceRecord.objects.filter(lesson=self.lesson).order_by("student_id")
+
+    def test_changes_on_current_version_are_applied(self):
+        previous_version = self.first.marked_at
+        updated, conflicts = apply_attendance_changes([
+            (self.first.student_id, self.lesson.id, AttendanceStatus.LATE, 5, self.first.marked_at),
+            (self.second.student_id, self.lesson.id, AttendanceStatus.ABSENT, None, None),
+        ])
+        self.assertEqual(len(updated), 2)
+        self.assertEqual(conflicts, [])
+        self.first.refresh_from_db()
+        self.assertEqual((self.first.status, self.first.minutes_late), (AttendanceStatus.LATE, 5))
+        self.assertGreater(self.first.marked_at, previous_version)
+
+    def test_change_on_stale_version_is_a_conflict(self):
+        stale = self.first.marked_at
+        apply_attendance_changes([(self.first.student_id, self.lesson.id, AttendanceStatus.PRESENT, None, stale)])
+        updated, conflicts = apply_attendance_changes([
+            (self.first.student_id, self.lesson.id, AttendanceStatus.ABSENT, None, stale),
+            (self.second.student_id, self.lesson.id, AttendanceStatus.ABSENT, None, self.second.marked_at),
+        ])
+        self.assertEqual([record.student_id for record in updated], [self.second.student_id])
+        self.assertEqual([record.student_id for record in conflicts], [self.first.student_id])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, AttendanceStatus.PRESENT)
+
+    def test_later_changes_to_a_conflicting_record_are_not_applied(self):
+        apply_attendance_changes([(self.first.student_id, self.lesson.id, AttendanceStatus.PRESENT, None, None)])
+        _, conflicts = apply_attendance_changes([
+            (self.first.student_id, self.lesson.id, AttendanceStatus.ABSENT, None, self.first.marked_at),
+            (self.first.student_id, self.lesson.id, AttendanceStatus.LATE, 3, None),
+        ])
+        self.assertEqual(len(conflicts), 1)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, AttendanceStatus.PRESENT)
+
+
+class MergeAttendanceDeltasTests(TestCase):
+    def setUp(self):
+        _, _, self.lessons = create_school(student_num=1, period_num=1)
+        self.lesson = self.lessons[0]
+        # Marked an hour ago, leaving room for offline changes since:
+        # changes from the future are clamped to now.
+        AttendanceRecord.objects.update(marked_at=timezone.now() - timedelta(hours=1))
+        self.record = AttendanceRecord.objects.get(lesson=self.lesson)
+
+    def test_offline_change_newer_than_the_server_mark_wins(self):
+        marked_offline = self.record.marked_at + timedelta(minutes=1)
+        updated = merge_attendance_deltas(self.lesson.id, [(self.record.student_id, AttendanceStatus.ABSENT, None, marked_offline)])
+        self.assertEqual(len(updated), 1)
+        self.record.refresh_from_db()
+        self.assertEqual((self.record.status, self.record.marked_at), (AttendanceStatus.ABSENT, marked_offline))
+
+    def test_server_mark_newer_than_the_offline_change_wins(self):
+        marked_offline = self.record.marked_at
+        apply_attendance_changes([(self.record.student_id, self.lesson.id, AttendanceStatus.PRESENT, None, None)])
+        updated = merge_attendance_deltas(self.lesson.id, [(self.record.student_id, AttendanceStatus.ABSENT, None, marked_offline)])
+        self.assertEqual(updated, [])
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.status, AttendanceStatus.PRESENT)
+
+    def test_latest_change_in_the_log_wins_whatever_its_position(self):
+        marked_offline = self.record.marked_at + timedelta(minutes=1)
+        merge_attendance_deltas(self.lesson.id, [
+            (self.record.student_id, AttendanceStatus.LATE, 4, marked_offline + timedelta(minutes=1)),
+            (self.record.student_id, AttendanceStatus.ABSENT, None, marked_offline),
+        ])
+        self.record.refresh_from_db()
+        self.assertEqual((self.record.status, self.record.minutes_late), (AttendanceStatus.LATE, 4))
+
+class SectionDayChangesTests(TestCase):
+    def setUp(self):
+        self.user, _, self.lessons = create_school(student_num=2, period_num=1)
+        self.lesson = self.lessons[0]
+        self.first, self.second = AttendanceRecord.objects.filter(lesson=self.lesson).order_by("student_id")
+        self.marked_at = timezone.now() - timedelta(hours=2)
+        AttendanceRecord.objects.update(marked_at=self.marked_at, updated_at=self.marked_at)
+        self.client.force_login(self.user)
+        self.url = reverse("att:section-day-changes", args=[Section.objects.get().id, DAY.year, DAY.month, DAY.day])
+
+    def changes(self, since):
+        return self.client.get(self.url, {"since": since}).json()
+
+    def test_offline_change_synced_late_is_in_the_next_changes(self):
+        apply_attendance_changes([(self.first.student_id, self.lesson.id, AttendanceStatus.PRESENT, None, None)])
+        version = self.changes(self.marked_at.isoformat())["version"]
+
+        # Marked offline an hour ago, before the online change, and synced now.
+        delta = {"studentId": self.second.student_id, "status": AttendanceStatus.LATE, "minutesLate": 5, "markedAt": (self.marked_at + timedelta(hours=1)).isoformat()}
+        response = self.client.post(reverse("att:lesson-sync", args=[self.lesson.id]), {"deltas": [delta]}, content_type="application/json")
+        self.assertEqual(response.json()["status"], "ok")
+
+        changes = self.changes(version)
+        self.assertIn([self.second.student_id, self.lesson.period_id, self.lesson.id, AttendanceStatus.LATE, 5], changes["records"])
+        self.assertGreater(changes["version"], version)
+
+
+def create_scheduled_course(start_date, end_date):
+    """Create an academic year from 'start_date' to 'end_date' and a course
+    of two students scheduled on Mondays in the first period, with its
+    lessons generated from tomorrow on. Return the course and the period."""
+    AcademicYear.objects.create(name="Current", start_date=start_date, end_date=end_date)
+    teacher = Teacher.objects.create(user=User.objects.create_user("teacher@school.test"), first_name="Ada", last_name="Lovelace")
+    period = Period.objects.create(name="Period 1", start_time=time(8), end_time=time(8, 55))
+    course = Course.objects.create(name="Course - 1A", level=1, teacher=teacher, weekly_sessions=1)
+    students = Student.objects.bulk_create([Student(email=f"student{i}@school.test", first_name="Student", last_name=f"{i}") for i in range(2)])
+    Enrolment.objects.bulk_create([Enrolment(student=student, course=course) for student in students])
+    WeeklySchedule.objects.create(course=course, period=period, iso_weekday=1)
+    do_generate_all_lessons(SchoolCalendar(start_date, end_date))
+    return course, period
+
+
+class UpdateEnrolmentsTests(TestCase):
+    def test_unenrolling_removes_records_in_one_delete(self):
+        today = date.today()
+        course, _ = create_scheduled_course(today - timedelta(days=30), today + timedelta(days=90))
+        self.client.force_login(User.objects.get())
+        student_ids = list(Enrolment.objects.filter(course=course).values_list("student_id", flat=True))
+        future_records = AttendanceRecord.objects.filter(lesson__course=course).count()
+        self.assertGreater(future_records, 0)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("att:update-enrolments"), {"courseId": course.id, "remove": student_ids}, content_type="application/json").json()
+        self.assertEqual((response["unenrolled"], response["att_record_removed_num"]), (sorted(student_ids), future_records))
+        self.assertFalse(Enrolment.objects.filter(course=course).exists())
+        record_deletes = [query for query in queries.captured_queries if query["sql"].startswith('DELETE FROM "att_attendancerecord"')]
+        self.assertEqual(len(record_deletes), 1)
+
+
+class GenerateAllLessonsTests(TestCase):
+    def test_generating_again_adds_nothing(self):
+        today = date.today()
+        calendar = SchoolCalendar(today - timedelta(days=30), today + timedelta(days=90))
+        course, _ = create_scheduled_course(calendar.start_date, calendar.end_date)
+        lesson_num = Lesson.objects.filter(course=course).count()
+        self.assertGreater(lesson_num, 0)
+        self.assertEqual(do_generate_all_lessons(calendar), 0)
+        self.assertEqual(Lesson.objects.filter(course=course).count(), lesson_num)
+
+
+class CalendarChangeTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.start_date = today - timedelta(days=30)
+        self.end_date = today + timedelta(days=90)
+        # A Monday at least a week ahead, with lessons from tomorrow on.
+        self.monday = today + timedelta(days=7 + (1 - today.isoweekday()) % 7)
+        self.course, _ = create_scheduled_course(self.start_date, self.end_date)
+
+    def monday_records(self):
+        return AttendanceRecord.objects.filter(lesson__date=self.monday)
+
+    def test_calendar_diff(self):
+        holiday = self.monday + timedelta(days=1)
+        old = SchoolCalendar(self.start_date, self.end_date, [holiday])
+        new = SchoolCalendar(self.start_date, self.end_date + timedelta(days=2), [self.monday])
+        added, removed = calendar_diff(old, new)
+        self.assertEqual(added, [holiday, self.end_date + timedelta(days=1), self.end_date + timedelta(days=2)])
+        self.assertEqual(removed, [self.monday])
+
+    def test_removed_date_loses_its_lessons_and_gets_them_back(self):
+        self.assertEqual(do_update_calendar_dates([], [self.monday], SchoolCalendar(self.start_date, self.end_date, [self.monday])), (0, 1))
+        self.assertFalse(Lesson.objects.filter(date=self.monday).exists())
+        # Applying the same change again does nothing.
+        self.assertEqual(do_update_calendar_dates([], [self.monday], SchoolCalendar(self.start_date, self.end_date, [self.monday])), (0, 0))
+
+        self.assertEqual(do_update_calendar_dates([self.monday], [], SchoolCalendar(self.start_date, self.end_date)), (1, 0))
+        self.assertEqual(self.monday_records().count(), 2)
+
+    def test_marked_records_are_kept_and_completed_when_the_date_comes_back(self):
+        marked = self.monday_records().first()
+        marked.status = AttendanceStatus.ABSENT
+        marked.save()
+        self.assertEqual(do_update_calendar_dates([], [self.monday], SchoolCalendar(self.start_date, self.end_date, [self.monday])), (0, 0))
+        self.assertEqual(list(self.monday_records()), [marked])
+
+        self.assertEqual(do_update_calendar_dates([self.monday], [], SchoolCalendar(self.start_date, self.end_date)), (0, 0))
+        self.assertEqual(Lesson.objects.filter(date=self.monday).count(), 1)
+        self.assertEqual(self.monday_records().count(), 2)
+        self.assertEqual(self.monday_records().get(pk=marked.pk).status, AttendanceStatus.ABSENT)
+
+
+class UpdateSchedulesTests(TestCase):
+    def setUp(self):
+        today = date.today()
+        self.course, self.period = create_scheduled_course(today - timedelta(days=30), today + timedelta(days=90))
+        self.monday_lessons = Lesson.objects.filter(course=self.course, date__iso_week_day=1).count()
+        self.wednesday = (self.course.id, self.period.id, 3)
+
+    def wednesday_lessons(self):
+        return Lesson.objects.filter(course=self.course, date__iso_week_day=3)
+
+    def test_added_schedule_is_generated_once(self):
+        WeeklySchedule.objects.create(course=self.course, period=self.period, iso_weekday=3)
+        added, removed = do_update_schedules([self.wednesday], [])
+        self.assertGreater(added, 0)
+        self.assertEqual(removed, 0)
+        self.assertEqual(self.wednesday_lessons().count(), added)
+        self.assertEqual(AttendanceRecord.objects.filter(lesson__in=self.wednesday_lessons()).count(), 2 * added)
+        self.assertEqual(do_update_schedules([self.wednesday], []), (0, 0))
+        self.assertEqual(self.wednesday_lessons().count(), added)
+
+    def test_removed_schedule_is_deleted_once(self):
+        monday = (self.course.id, self.period.id, 1)
+        WeeklySchedule.objects.filter(course=self.course, iso_weekday=1).delete()
+        self.assertEqual(do_update_schedules([], [monday]), (0, self.monday_lessons))
+        self.assertEqual(do_update_schedules([], [monday]), (0, 0))
+
+    def test_slots_follow_the_current_schedules(self):
+        # A slot queued as added but unscheduled since is not generated,
+        # and one queued as removed but scheduled again is kept.
+        monday = (self.course.id, self.period.id, 1)
+        self.assertEqual(do_update_schedules([self.wednesday], [monday]), (0, 0))
+        self.assertFalse(self.wednesday_lessons().exists())
+        self.assertEqual(Lesson.objects.filter(course=self.course, date__iso_week_day=1).count(), self.monday_lessons)
+
+
+class OccupancyIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        today = date.today()
+        self.course, self.period = create_scheduled_course(today - timedelta(days=30), today + timedelta(days=90))
+        self.other = Course.objects.create(name="Other - 1A", level=1, weekly_sessions=1)
+        WeeklySchedule.objects.create(course=self.other, period=self.period, iso_weekday=1)
+        self.same_teacher = Course.objects.create(name="Same teacher - 1A", level=1, teacher=self.course.teacher, weekly_sessions=1)
+        self.client.force_login(User.objects.get())
+
+    def test_index_is_reused_until_enrolments_change(self):
+        index = get_occupancy_index()
+        self.assertEqual(index.scan(), [])
+        with self.assertNumQueries(0):
+            self.assertIs(get_occupancy_index(), index)
+
+        student_id = Enrolment.objects.filter(course=self.course).values_list("student_id", flat=True).first()
+        response = self.client.post(reverse("att:update-enrolments"), {"courseId": self.other.id, "add": [student_id]}, content_type="application/json")
+        self.assertEqual(response.json()["enrolled"], [student_id])
+        conflicts = get_occupancy_index().conflicts(self.other.id, self.period.id, 1)
+        self.assertEqual([(conflict.kind, conflict.resource_id) for conflict in conflicts], [(STUDENT, student_id)])
+
+    def toggle(self, course, iso_weekday):
+        return self.client.post(reverse("att:toggle-schedule"), {"courseId": course.id, "periodId": self.period.id, "day": iso_weekday}, content_type="application/json").json()
+
+    def test_toggling_a_schedule_updates_the_index_in_place(self):
+        index = get_occupancy_index()
+        slot = (self.same_teacher.id, self.period.id, 1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.toggle(self.same_teacher, 1)
+        self.assertEqual(response["status"], "created")
+        self.assertEqual(response["conflicts"][0]["teachers"], ["Ada Lovelace"])
+        self.assertFalse([query for query in queries.captured_queries if "att_enrolment" in query["sql"]])
+        self.assertIs(get_occupancy_index(), index)
+        self.assertIn(slot, index.schedules)
+
+        self.assertEqual(self.toggle(self.same_teacher, 1)["status"], "deleted")
+        self.assertIs(get_occupancy_index(), index)
+        self.assertNotIn(slot, index.schedules)
+        self.assertEqual(index.scan(), [])
+
+    def test_updated_timetable_reports_conflicts_between_new_slots(self):
+        index = get_occupancy_index()
+        timetables = {"courses": [
+            {"courseId": self.course.id, "slots": [{"periodId": self.period.id, "day": 2}]},
+            {"courseId": self.same_teacher.id, "slots": [{"periodId": self.period.id, "day": 2}]},
+            {"courseId": self.other.id, "slots": []},
+        ]}
+        response = self.client.post(reverse("att:update-timetable"), timetables, content_type="application/json").json()
+        self.assertEqual(response["removed"], [[self.course.id, self.period.id, 1], [self.other.id, self.period.id, 1]])
+        self.assertEqual([(conflict["iso_weekday"], conflict["teachers"]) for conflict in response["conflicts"]], [(2, ["Ada Lovelace"])])
+        self.assertIs(get_occupancy_index(), index)
+        self.assertEqual(index.schedules, {(self.course.id, self.period.id, 2), (self.same_teacher.id, self.period.id, 2)})
+
+
+class StudentSearchIndexTests(TestCase):
+    def test_ranking_of_names(self):
+        index = StudentSearchIndex([
+            (1, "García López", "Lucía"), (2, "García Pérez", "Hugo"), (3, "Gómez García", "Sara"),
+            (4, "López Ruiz", "Mateo"), (5, "Garcés Ruiz", "Alba"), (6, "Martín García", "Lucía")
+        ])
+        self.assertEqual([student_id for _, _, _, student_id in index.extract("lucia garcia", limit=3)], [1, 6, 2])
+        self.assertEqual([student_id for _, _, _, student_id in index.extract("lopez", limit=2)], [1, 4])
+
+    def test_ranking_is_the_same_as_scoring_every_name(self):
+        rng = random.Random(0)
+        index = StudentSearchIndex((i, f"{rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}", rng.choice(FIRST_NAMES)) for i in range(1000))
+        queries = ["", "g", "zz"]
+        for choice in rng.sample(index.choices, 60):
+            words = choice.split()
+            typo = list(choice)
+            typo[rng.randrange(len(typo))] = rng.choice("aeiou")
+            queries += [choice[:rng.randint(2, 12)], " ".join(rng.sample(words, len(words))), "".join(typo)]
+        for query in queries:
+            with self.subTest(query=query):
+                expected = process.extract(utils.default_process(query), index.choices, scorer=fuzz.WRatio, processor=None, limit=10)
+                self.assertEqual([(score, i) for _, score, i, _ in index.extract(query)], [(score, i) for _, score, i in expected])
+
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        Section.objects.create(name="1A", level=1)
+        Section.objects.create(name="1B", level=1)
+        self.students = [(f"student{i}@school.test", "Student", f"{i:03}", "1A" if i % 2 else "1B") for i in range(50)]
+
+    def test_students_are_created_in_bulk_and_updated_on_rerun(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk_import_students(self.students, upsert=True), (50, 0))
+        self.assertEqual(sum(query["sql"].startswith('INSERT INTO "att_student"') for query in queries), 1)
+        self.students[0] = ("student0@school.test", "Renamed", "000", "1A")
+        self.assertEqual(bulk_import_students(self.students, upsert=True), (0, 50))
+        self.assertEqual(Student.objects.count(), 50)
+        self.assertEqual(Student.objects.get(email="student0@school.test").first_name, "Renamed")
+
+    def test_teachers_are_created_in_bulk_and_updated_on_rerun(self):
+        teachers = [(f"Teacher{i}@school.test", "Teacher", f"{i:03}") for i in range(10)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(bulk_import_teachers(teachers, upsert=True), (10, 0))
+        self.assertEqual([query["sql"].split(" ", 3)[2] for query in queries if query["sql"].startswith("INSERT")], ['"auth_user"', '"att_teacher"'])
+        self.assertEqual(bulk_import_teachers(teachers, upsert=True), (0, 10))
+        self.assertEqual((User.objects.count(), Teacher.objects.count()), (10, 10))
+        self.assertFalse(User.objects.get(username="teacher0@school.test").has_usable_password())
+
+class ParserTests(SimpleTestCase):
+    # A course sheet as exported to csv: labels and values are spread
+    # over columns, with free notes around them.
+    ROWS = [
+        ["Curso 2024-2025", "", "", ""],
+        ["", "Materia:", "", "Matemáticas I"],
+        ["", "Profesor:", "", "Ada Lovelace"],
+        ["", "", "Nota", ""],
+        ["", "Grupos:", "", "1A 1B"],
+        ["Nº", "Alumno", "Anotaciones", ""],
+        ["1", "Ruiz, Alba", "alba.ruiz@school.test", ""],
+        ["2", "Gómez, Hugo", "hugo.gomez@school.test", ""],
+        ["", "", "", "Firma"],
+        ["3", "Anotaciones", "not.a.student@school.test", ""],
+    ]
+
+    def test_course_is_extracted(self):
+        self.assertEqual(Parser().parse_rows(self.ROWS), {
+            "name": "Matemáticas I",
+            "teacher": "Ada Lovelace",
+            "sections": "1A 1B",
+            "students": ["alba.ruiz@school.test", "hugo.gomez@school.test"]
+        })
+
+    def test_scanning_stops_after_the_students(self):
+        rows = iter(self.ROWS)
+        Parser().parse_rows(rows)
+        self.assertEqual(next(rows), self.ROWS[-1])
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_runs_on_a_seeded_school(self):
+        call_command("seed_school", sections=2, students_per_section=3, courses_per_section=2, weekly_sessions=1, periods=2, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Student.objects.count(), 6)
+        stdout = StringIO()
+        call_command("benchmark", repeat=1, stdout=stdout, stderr=StringIO())
+        results = json.loads(stdout.getvalue())["results"]
+        self.assertEqual(set(results), {
+            "generate_all_lessons", "report_day", "report_from", "report_student", "lesson_detail", "week_view",
+            "student_week", "search_student", "mark_attendance_batch", "import_courses"
+        })
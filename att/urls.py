@@ -13,17 +13,28 @@ urlpatterns =[
     path("<int:year>/<str:month>/<int:day>/", views.LessonsOnDay.as_view(), name="lessons-on-day"),
     path("student/<int:student_id>/<int:year>/<int:month>/<int:day>/", views.student_on_day, name="student-on-day"),
     path("student-week/<int:student_id>/<int:year>/<int:month>/<int:day>/", views.StudentWeekView.as_view(), name="student-week"),
+    path("section-week/<int:section_id>/<int:year>/<int:month>/<int:day>/", views.SectionWeekView.as_view(), name="section-week"),
     path("week/<int:year>/<int:month>/<int:day>/", views.WeekView.as_view(), name="week-view"),
     path("current-week/", views.CurrentWeekView.as_view(), name="current-week"),
     path("lesson/<int:lesson_id>/", views.lesson_detail, name="lesson-detail"),
+    path("lesson/<int:lesson_id>/sync/", views.sync_lesson_attendance, name="lesson-sync"),
     path("mark-attendance/", views.mark_attendance, name="mark-attendance"),
+    path("mark-attendance-batch/", views.mark_attendance_batch, name="mark-attendance-batch"),
     path("mark-unregistered-present/", views.mark_unregistered_present, name="mark-unregistered-present"),
     path("report-day/<int:year>/<int:month>/<int:day>/", views.report_day, name="report-day"),
     path("report-today/", views.report_today, name="report-today"),
     path("report-from/<int:year>/<int:month>/<int:day>/", views.report_from, name="report-from"),
     path("report-from-start/", views.report_from_start, name="report-from-start"),
+    path("sections-day/<int:year>/<int:month>/<int:day>/", views.sections_day, name="sections-day"),
+    path("sections-today/", views.sections_today, name="sections-today"),
+    path("section-day/<int:section_id>/<int:year>/<int:month>/<int:day>/", views.section_day, name="section-day"),
+    path("section-day/<int:section_id>/<int:year>/<int:month>/<int:day>/changes/", views.section_day_delta, name="section-day-changes"),
     path("report-student-select/", views.report_student_select, name="report-student-select"),
     path("report-student/<int:student_id>/", views.report_student, name="report-student"),
+    path("export/report-day/<int:year>/<int:month>/<int:day>/", views.export_report_day, name="export-report-day"),
+    path("export/report-from/<int:year>/<int:month>/<int:day>/", views.export_report_from, name="export-report-from"),
+    path("export/report-student/<int:student_id>/", views.export_report_student, name="export-report-student"),
+    path("export/attendance/", views.export_attendance, name="export-attendance"),
     path("select-student/", views.select_student, name="select-student"),
     path("search-student/", views.search_student, name="search-student"),
     path("do-search-students/", views.do_search_students, name="do-search-students"),
@@ -36,12 +47,16 @@ urlpatterns =[
     path("import-students/", views.import_students, name="import-students"),
     path("setup-courses/", views.setup_courses, name="setup-courses"),
     path("import-courses/", views.import_courses, name="import-courses"),
+    path("update-enrolments/", views.update_enrolments, name="update-enrolments"),
     path("setup-timetables/", views.SetupTimetables.as_view(), name="setup-timetables"),
     path("setup-timetable/<int:pk>/", views.SetupTimetable.as_view(), name="setup-timetable"),
     path("toggle-schedule/", views.toggle_schedule, name="toggle-schedule"),
+    path("update-timetable/", views.update_timetable, name="update-timetable"),
     path("setup-nonschool-day/", views.SetupNonSchoolDays.as_view(), name="setup-nonschool-days"),
     path("setup-lessons/", views.setup_lessons, name="setup-lessons"),
     path("generate-lessons/", views.generate_lessons, name="generate-lessons"),
     path("setup-attendance-records/", views.setup_attendance_records, name="setup-attendance-records"),
-    path("generate-attendance-records/", views.generate_attendance_records, name="generate-attendance-records")
+    path("generate-attendance-records/", views.generate_attendance_records, name="generate-attendance-records"),
+    path("job/<int:job_id>/", views.job_status, name="job-status"),
+    path("query-stats/", views.query_stats_view, name="query-stats")
 ]
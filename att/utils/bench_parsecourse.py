@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Compare the course sheet scanner in att.parsecourse with the previous
+event-per-cell state machine on sample sheets.
+
+Usage (from the project root):
+    python -m att.utils.bench_parsecourse files/*.xls [--repeat N]
+"""
+
+import argparse
+import csv
+import timeit
+from pathlib import Path
+
+from att.parsecourse import Parser, xls_rows
+
+
+class LegacyParser():
+    """The parser as it was before the single-pass scanner:
+    one event dict per cell and one state transition per event."""
+
+    def __init__(self):
+        self.cols = {'subject_col': None, 'students_col': None}
+        self.course = {'name': None, 'teacher': None, 'sections': [], 'students': []}
+        self.state = self.find_subject
+
+    def find_student(self, event):
+        if event['col'] == self.cols['students_col'] and event['value']:
+            self.course['students'].append(event['value'])
+        return self.find_student
+
+    def find_students_col(self, event):
+        if event['value'] == 'Anotaciones':
+            self.cols['students_col'] = event['col']
+            return self.find_student
+        return self.find_students_col
+
+    def find_sections(self, event):
+        if event['col'] == self.cols['subject_col'] and event['value']:
+            self.course['sections'] = event['value']
+            return self.find_students_col
+        return self.find_sections
+
+    def find_teacher(self, event):
+        if event['col'] == self.cols['subject_col'] and event['value']:
+            self.course['teacher'] = event['value']
+            return self.find_sections
+        return self.find_teacher
+
+    def find_subject_name(self, event):
+        if event['value']:
+            self.course['name'] = event['value']
+            self.cols['subject_col'] = event['col']
+            return self.find_teacher
+        return self.find_subject_name
+
+    def find_subject(self, event):
+        if event['value'] == 'Materia:':
+            return self.find_subject_name
+        return self.find_subject
+
+    def parse_rows(self, rows):
+        for row_index, row in enumerate(rows):
+            for col_index, field in enumerate(row):
+                self.state = self.state({'row': row_index, 'col': col_index, 'value': field.strip()})
+        return self.course
+
+def load_rows(path):
+    if path.suffix == '.xls':
+        return list(xls_rows(path.read_bytes()))
+    with open(path, 'r', encoding='utf-8', newline='\n') as f:
+        return list(csv.reader(f))
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('sheets', nargs='+', type=Path)
+    argparser.add_argument('--repeat', type=int, default=100)
+    args = argparser.parse_args()
+
+    sheets = [load_rows(path) for path in args.sheets]
+    for path, rows in zip(args.sheets, sheets):
+        if Parser().parse_rows(rows) != LegacyParser().parse_rows(rows):
+            print(f"{path}: parsers disagree")
+
+    for name, parser_class in (('legacy', LegacyParser), ('scanner', Parser)):
+        seconds = timeit.timeit(lambda: [parser_class().parse_rows(rows) for rows in sheets], number=args.repeat)
+        print(f"{name:>8}: {seconds / args.repeat * 1000:.3f} ms for {len(sheets)} sheets")
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,15 @@
 import re
 from django.shortcuts import get_object_or_404, render
-from django.http import JsonResponse, HttpResponseRedirect
+from django.http import Http404, JsonResponse, HttpResponseRedirect
 from django.views import generic
 from django.views.generic.dates import DayArchiveView
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_http_methods
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.contrib.auth.models import User
 from django.db import transaction
-from django.db.models import Count, F, Value, Q
-from django.db.models.functions import Concat
+from django.db.models import Count, F
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
@@ -19,9 +18,6 @@ from datetime import date, time, timedelta, datetime
 import json
 import csv
 from io import TextIOWrapper
-import xlrd
-from pathlib import Path
-from rapidfuzz import process, fuzz
 
 class GoogleRawLoginCredentials:
     def __init__(self, client_id = "", client_secret = "", project_id = ""):
@@ -48,95 +44,30 @@ def google_login_get_credentials():
 
 # Create your views here.
 
-from .models import AcademicYear, Course, Enrolment, Lesson, NonSchoolDay, Student, AttendanceRecord, Period, Teacher, Section, WeeklySchedule, AttendanceStatus
+from .models import AcademicYear, Course, Enrolment, Job, Lesson, NonSchoolDay, Student, AttendanceRecord, Period, Teacher, Section, WeeklySchedule, AttendanceStatus
 from .forms import AcademicYearForm
-from .parsecourse import Parser
-
-
-def weekdayrange(from_date: date, to_date: date, iso_weekday, filter_fn=None):
-    """
-    Iterates over all days with given iso_weekday,
-    in the range [from_date, to_date) for which filter_fn returns True.
-    """
-    days_ahead = (iso_weekday - from_date.isoweekday()) % 7
-    current = from_date + timedelta(days=days_ahead)
-    while current < to_date:
-        if filter_fn is None or filter_fn(current):
-            yield current
-        current += timedelta(days=7)
-
-def is_school_day(d: date):
-    ay = AcademicYear.objects.all()[0]
-    return (d >= ay.start_date) and (d <= ay.end_date) and (NonSchoolDay.objects.filter(date=d).count() == 0)
-
-def is_future_school_day(d: date):
-    return is_school_day(d) and d > date.today()
-
-def is_past_school_day(d: date):
-    return is_school_day(d) and d < date.today()
-
-def do_generate_attendance_records(lesson: Lesson):
-    """Generate attendance records for given lesson."""
-    att_record_num = 0
-    enrolment_set = Enrolment.objects.filter(course=lesson.course)
-    for enrolment in enrolment_set.iterator():
-        ar = AttendanceRecord(
-            student=enrolment.student,
-            lesson=lesson,
-            status=AttendanceStatus.UNREGISTERED
-        )
-        ar.save()
-        att_record_num = att_record_num + 1
-    return att_record_num
-
-def do_generate_all_attendance_records():
-    """Generate an attendance record for every student for every lesson he's enrolled in."""
-    lesson_set = Lesson.objects.all()
-    att_record_num = 0
-    for lesson in lesson_set.iterator():
-        att_records_added = do_generate_attendance_records(lesson)
-        att_record_num = att_record_num + att_records_added
-    return att_record_num
-
-# TODO Eliminate redundancy in the weekdayrange call.
-# The filter only takes into account the academic year, but the start and end are already
-# limiting that. At the same time, the filter only allows for future dates,
-# but we could set from_date = date.today() to achieve the same result.
-def do_generate_lessons_and_att_records(ws: WeeklySchedule, from_date: date, to_date: date):
-    """Generate lessons corresponding to a weekly schedule."""
-    lesson_num = 0
-    teacher = ws.course.teacher
-    for d in weekdayrange(from_date, to_date, ws.iso_weekday, filter_fn=is_future_school_day):
-        if d < to_date:
-            lesson = Lesson(
-                course=ws.course,
-                teacher=teacher,
-                period=ws.period,
-                date=d,
-                start_datetime=timezone.datetime(d.year, d.month, d.day, ws.period.start_time.hour, ws.period.start_time.minute)
-            )
-            lesson.save()
-            do_generate_attendance_records(lesson)
-            lesson_num = lesson_num + 1
-    return lesson_num
-
-def do_generate_all_lessons():
-    course_start = AcademicYear.objects.all()[0].start_date
-    course_end = AcademicYear.objects.all()[0].end_date + timedelta(days=1)
-    weekly_schedule_set = WeeklySchedule.objects.all()
-    lesson_num = 0
-    for ws in weekly_schedule_set.iterator():
-        generated_lessons = do_generate_lessons_and_att_records(ws, course_start, course_end)
-        lesson_num = lesson_num + generated_lessons
-    return lesson_num
-
-def do_delete_lessons(ws: WeeklySchedule, course_start: date, course_end: date):
-    """Delete all lessons scheduled by 'ws' weekly schedule."""
-    Lesson.objects.filter(course=ws.course).filter(period=ws.period).filter(date__iso_week_day=ws.iso_weekday).filter(date__gte=course_start).filter(date__lte=course_end).delete()
+from .generation import do_add_enrolment_records, do_remove_enrolment_records, schedule_filter
+from .schoolcalendar import SchoolCalendar
+from .search import get_student_search_index
+from .marking import apply_attendance_changes, parse_attendance_change, record_to_dict, record_version
+from .marking import lesson_snapshot, merge_attendance_deltas, parse_attendance_delta, parse_version
+from .summary import day_report_records, refresh_record_summaries, students_with_summary
+from .cache import bump_version, get_version
+from .reportcache import attendance_version, cached_report, day_version, invalidate_reports, student_version
+from .dashboard import section_day_changes, section_day_grid, section_period_counts
+from .weekgrid import build_empty_week_grid, build_student_week_grid, build_student_week_grids, get_periods, get_week_grid, next_lesson_id, previous_lesson_id
+from .importers import bulk_import_teachers, bulk_import_students
+from .jobs import enqueue_calendar_change, enqueue_job, job_to_dict
+from .querystats import query_budget, query_stats
+from .signals import enrolment_records_removed
+from .conflicts import conflicts_to_dicts, get_occupancy_index, update_occupancy_index
+from .exports import EXPORT_FORMATS, day_report_export_rows, export_response, school_export_rows, student_export_rows, summary_export_rows
+
 
 class WeekView(LoginRequiredMixin, generic.TemplateView):
     """Overview given week's lessons."""
     template_name = "att/week_view.html"
+    query_budget = 6
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -148,14 +79,8 @@ class WeekView(LoginRequiredMixin, generic.TemplateView):
         next_week = start_of_week + timedelta(days=7)
         week_days = [start_of_week + timedelta(days=i) for i in range(5)]
 
-        loggedin_user = self.request.user
-        periods = Period.objects.all().order_by("start_time")
-        lessons = Lesson.objects.filter(teacher__user=loggedin_user).filter(date__range=(start_of_week, end_of_week))
-        lessons_by_day = {day: {period: None for period in periods} for day in week_days}
-        for lesson in lessons:
-            lessons_by_day[lesson.date][lesson.period] = lesson
-        # lessons_ordered = [lessons_by_day[day] for day in week_days]
-        days_and_lessons = zip(week_days, [zip(periods, [lessons_by_day[day][period] for period in periods]) for day in week_days])
+        teacher = get_object_or_404(Teacher, user=self.request.user)
+        periods, days_and_lessons = get_week_grid(teacher, start_of_week)
 
         context["week_days"] = week_days
         context["periods"] = periods
@@ -164,7 +89,7 @@ class WeekView(LoginRequiredMixin, generic.TemplateView):
         context["end_of_week"] = end_of_week
         context["previous_week"] = previous_week
         context["next_week"] = next_week
-        context["teacher"] = get_object_or_404(Teacher, user=loggedin_user)
+        context["teacher"] = teacher
 
         return context
 
@@ -173,7 +98,8 @@ class CurrentWeekView(WeekView):
 
     def get(self, request, *args, **kwargs):
         today = timezone.localdate()
-        return WeekView.as_view()(request, year=today.year, month=today.month, day=today.day)
+        self.kwargs = {"year": today.year, "month": today.month, "day": today.day}
+        return super().get(request, *args, **self.kwargs)
 
 def unauthorised(request):
     return render(request, "att/unauthorised.html")
@@ -192,6 +118,7 @@ def landing_view(request):
 
 class LessonsOnDay(LoginRequiredMixin, DayArchiveView):
     """View list of lesson on 'date'"""
+    query_budget = 8
     template_name = "att/lessons_on_day.html"
     context_object_name = "lessons_list"
     date_field = "date"
@@ -240,16 +167,6 @@ class LessonsToday(LessonsOnDay):
     def get_date(self):
         return timezone.localdate()
 
-def next_lesson(current_lesson):
-    teacher = current_lesson.teacher
-    nl = Lesson.objects.filter(teacher=teacher).filter(start_datetime__gt=current_lesson.start_datetime).order_by("start_datetime")
-    return nl.first() if nl else None
-
-def previous_lesson(current_lesson):
-    teacher = current_lesson.teacher
-    pl = Lesson.objects.filter(teacher=teacher).filter(start_datetime__lt=current_lesson.start_datetime).order_by("start_datetime")
-    return pl.last() if pl else None
-
 def get_lesson_students_with_attendance_fields(lesson):
     """Return students enrolled in 'lesson' annotated with
     'attendance_status' and 'minutes_late' taken from the first
@@ -257,20 +174,22 @@ def get_lesson_students_with_attendance_fields(lesson):
     for that 'lesson'."""
     return AttendanceRecord.objects.filter(lesson=lesson).select_related("student")
 
+@query_budget(8)
 @login_required
 def lesson_detail(request, lesson_id):
     """View list of students enrolled in lesson whose id is 'lesson_id'
     annotated with attendance fields."""
-    lesson = get_object_or_404(Lesson, pk=lesson_id)
+    lesson = get_object_or_404(Lesson.objects.select_related("course", "period"), pk=lesson_id)
     attendance_records = get_lesson_students_with_attendance_fields(lesson)
     context = {
         "lesson": lesson,
         "attendance_records": attendance_records,
-        "previous_lesson": previous_lesson(lesson),
-        "next_lesson": next_lesson(lesson)
+        "previous_lesson_id": previous_lesson_id(lesson),
+        "next_lesson_id": next_lesson_id(lesson)
     }
     return render(request, "att/lesson.html", context)
 
+@query_budget(8)
 @login_required
 def student_on_day(request, student_id, year, month, day):
     day = date(year, month, day)
@@ -289,6 +208,7 @@ def student_on_day(request, student_id, year, month, day):
 class StudentWeekView(LoginRequiredMixin, generic.TemplateView):
     """Overview given week's lessons."""
     template_name = "att/student_week.html"
+    query_budget = 8
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -301,20 +221,12 @@ class StudentWeekView(LoginRequiredMixin, generic.TemplateView):
         week_days = [start_of_week + timedelta(days=i) for i in range(5)]
 
         student_id = int(self.kwargs["student_id"])
-        student = get_object_or_404(Student, pk=student_id)
-
-        loggedin_user = self.request.user
-        periods = Period.objects.all().order_by("start_time")
-        records = AttendanceRecord.objects.filter(student=student).filter(lesson__date__range=(start_of_week, end_of_week))
-        records_by_day = {day: {period: None for period in periods} for day in week_days}
-        for record in records:
-            records_by_day[record.lesson.date][record.lesson.period] = record
-        # lessons_ordered = [lessons_by_day[day] for day in week_days]
-        days_and_records = zip(week_days, [zip(periods, [records_by_day[day][period] for period in periods]) for day in week_days])
+        student = get_object_or_404(Student.objects.select_related("section"), pk=student_id)
+        days_and_records = build_student_week_grid(student.id, start_of_week)
 
         context["today"] = timezone.localdate()
         context["week_days"] = week_days
-        context["periods"] = periods
+        context["periods"] = [period for period, _ in days_and_records[0][1]]
         context["records_by_day"] = days_and_records
         context["start_of_week"] = start_of_week
         context["end_of_week"] = end_of_week
@@ -324,17 +236,43 @@ class StudentWeekView(LoginRequiredMixin, generic.TemplateView):
 
         return context
 
+class SectionWeekView(LoginRequiredMixin, generic.TemplateView):
+    """Overview the attendance of every student of a section in given week."""
+    template_name = "att/section_week.html"
+    query_budget = 8
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        target_date = date(int(self.kwargs["year"]), int(self.kwargs["month"]), int(self.kwargs["day"]))
+        start_of_week = target_date - timedelta(days=target_date.isoweekday()-1)
+        end_of_week = start_of_week + timedelta(days=6)
+
+        section = get_object_or_404(Section, pk=int(self.kwargs["section_id"]))
+        students = Student.objects.filter(section=section).order_by("last_name", "first_name")
+        grids = build_student_week_grids(AttendanceRecord.objects.filter(student__section=section), start_of_week)
+        empty_grid = build_empty_week_grid(start_of_week)
+
+        context["today"] = timezone.localdate()
+        context["week_days"] = [day for day, _ in empty_grid]
+        context["periods"] = [period for period, _ in empty_grid[0][1]]
+        context["students_and_records"] = [(student, grids.get(student.id, empty_grid)) for student in students]
+        context["start_of_week"] = start_of_week
+        context["end_of_week"] = end_of_week
+        context["previous_week"] = start_of_week - timedelta(days=7)
+        context["next_week"] = start_of_week + timedelta(days=7)
+        context["section"] = section
+
+        return context
+
 @login_required
 @require_POST
 def search_student(request):
     try:
         data = json.loads(request.body)
         searchstr = data["searchstr"]
-        students = Student.objects.all().order_by("last_name", "first_name")
-        choices = [f"{student.last_name}, {student.first_name}" for student in students]
-        result, score, index = process.extractOne(searchstr, choices, scorer=fuzz.WRatio)
-        student = students[index]
-        return JsonResponse({"status": "ok", "result": result, "student": student.id})
+        result, score, index, student_id = get_student_search_index().extract_one(searchstr)
+        return JsonResponse({"status": "ok", "result": result, "student": student_id})
     except Exception as e:
         return JsonResponse({"status": "error", "message": str(e)}, status=400)
 
@@ -342,7 +280,8 @@ def search_result_to_dict(search_result):
     result_dict = {
         'name': search_result[0],
         'score': search_result[1],
-        'index': search_result[2]
+        'index': search_result[2],
+        'student_id': search_result[3]
     }
     return result_dict
 
@@ -352,12 +291,8 @@ def do_search_students(request):
     try:
         data = json.loads(request.body)
         searchstr = data["searchstr"]
-        students = Student.objects.all().order_by("last_name", "first_name")
-        names = [f"{student.last_name}, {student.first_name}" for student in students]
-        names_found = process.extract(searchstr, names, scorer=fuzz.WRatio, limit=10)
+        names_found = get_student_search_index().extract(searchstr, limit=10)
         search_results = [search_result_to_dict(search_result) for search_result in names_found]
-        for result in search_results:
-            result['student_id'] = students[result['index']].id
         return JsonResponse({"status": "ok", "search_results": search_results})
     except Exception as e:
         return JsonResponse({"status": "error", "message": str(e)}, status=400)
@@ -369,23 +304,38 @@ def select_student(request):
     return render(request, "att/select_student.html", context)
 
 
+def day_report_rows(day, periods):
+    """Return one row per student with any absence or late mark on 'day',
+    holding the student's attendance record for each of 'periods'
+    (None when the student has no lesson in that period).
+
+    All the day's records of those students are fetched in a single query
+    and pivoted into the student x period grid."""
+    records = day_report_records(day).select_related("student", "lesson__period")
+    rows = {}
+    for record in records:
+        row = rows.setdefault(record.student_id, {"student": record.student, "records_by_period": {}})
+        row["records_by_period"].setdefault(record.lesson.period_id, record)
+    return [
+        {
+            "student": row["student"],
+            "attendance_records": [row["records_by_period"].get(p.id) for p in periods]
+        }
+        for row in rows.values()
+    ]
+
+@query_budget(8)
 @login_required
 def report_day(request, year, month, day):
     """Return students that have any absence or late marks on given date."""
     day = date(year, month, day)
     today = timezone.localdate()
-    negative_attendance_records = AttendanceRecord.objects.filter(status__in=["absent", "late"])
-    periods = Period.objects.all().order_by("start_time")
-    attendance_records =[
-        {
-            "student": s,
-            "attendance_records": [
-                AttendanceRecord.objects.filter(lesson__date=day).filter(student=s).filter(lesson__period=p)
-                for p in Period.objects.all().order_by("start_time")
-            ]
-        }
-        for s in Student.objects.filter(attendancerecord__status__in=["absent", "late"], attendancerecord__lesson__date=day).distinct().order_by("last_name", "first_name")
-    ]
+
+    def build_report():
+        periods = list(Period.objects.all().order_by("start_time"))
+        return periods, day_report_rows(day, periods)
+
+    periods, attendance_records = cached_report("day", [day], [day_version(day), get_version("timetable"), get_version("students")], build_report)
 
     context = {
         "periods": periods,
@@ -405,30 +355,99 @@ def report_today(request):
     return HttpResponseRedirect(f"/att/report-day/{today.year}/{today.month}/{today.day}/")
 
 
+@query_budget(8)
+@login_required
+def sections_day(request, year, month, day):
+    """Return the number of records of each status on given date
+    by section and period."""
+    day = date(year, month, day)
+    periods = get_periods()
+    counts = section_period_counts(day)
+    sections = [
+        {
+            "section": section,
+            "counts": [counts.get(section.id, {}).get(period.id) for period in periods]
+        }
+        for section in Section.objects.filter(pk__in=counts.keys()).order_by("level", "name")
+    ]
+    context = {
+        "periods": periods,
+        "sections": sections,
+        "date": day,
+        "today": timezone.localdate(),
+        "previous_day": day - timedelta(days=1),
+        "next_day": day + timedelta(days=1)
+    }
+    return render(request, "att/sections_day.html", context)
+
+@login_required
+def sections_today(request):
+    today = timezone.localdate()
+    return HttpResponseRedirect(reverse("att:sections-day", args=[today.year, today.month, today.day]))
+
+@query_budget(8)
+@login_required
+def section_day(request, section_id, year, month, day):
+    """Return the attendance of every student of a section on given date,
+    by period."""
+    day = date(year, month, day)
+    section = get_object_or_404(Section, pk=section_id)
+    periods = get_periods()
+    attendance_records, version = section_day_grid(section.id, day, periods)
+    context = {
+        "section": section,
+        "periods": periods,
+        "attendance_records": attendance_records,
+        "version": version.isoformat() if version else "",
+        "date": day,
+        "today": timezone.localdate(),
+        "previous_day": day - timedelta(days=1),
+        "next_day": day + timedelta(days=1)
+    }
+    return render(request, "att/section_day.html", context)
+
+@query_budget(4)
+@login_required
+def section_day_delta(request, section_id, year, month, day):
+    """Return the records of a section's students on given date
+    updated since the 'since' version, and the new version."""
+    try:
+        since = parse_version(request.GET.get("since"))
+        changes, version = section_day_changes(section_id, date(year, month, day), since)
+        return JsonResponse({"status": "ok", "version": version.isoformat() if version else "", "records": changes})
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
 @login_required
 def report_student_select(request):
     return render(request, "att/report_student_select.html")
 
 
+@query_budget(6)
 @login_required
 def report_student(request, student_id):
     """Return all late or absent attendance records for given student."""
     student = get_object_or_404(Student, pk=student_id)
-    records = AttendanceRecord.objects.filter(student_id=student_id, status__in=["absent","late"]).order_by("lesson__date", "lesson__period__start_time")
+    records = cached_report(
+        "student", [student_id], [student_version(student_id), get_version("timetable")],
+        lambda: list(AttendanceRecord.objects.filter(student_id=student_id, status__in=["absent","late"]).select_related("lesson__course", "lesson__period").order_by("lesson__date", "lesson__period__start_time"))
+    )
     context = {
         "student": student,
         "records": records
     }
     return render(request, "att/report_student.html", context)
 
+@query_budget(6)
 @login_required
 def report_from(request, year, month, day):
     """Return students that have any absence or late marks for given month, with summary."""
     from_day = date(year, month, day)
     today = timezone.localdate()
-    late = Count("attendancerecord", filter=Q(attendancerecord__status="late"))
-    absent = Count("attendancerecord", filter=Q(attendancerecord__status="absent"))
-    students = Student.objects.filter(attendancerecord__lesson__date__gte=from_day, attendancerecord__status__in=["absent", "late"]).annotate(late=late).annotate(absent=absent).order_by("-absent", "-late", "last_name", "first_name")
+    students = cached_report(
+        "from", [from_day], [attendance_version(), get_version("students")],
+        lambda: list(students_with_summary(from_day).order_by("-absent", "-late", "last_name", "first_name"))
+    )
     context = {
         "students": students,
         "from_day": from_day,
@@ -440,12 +459,49 @@ def report_from(request, year, month, day):
 
 @login_required
 def report_from_start(request):
-    academic_year = AcademicYear.objects.all()[0]
-    start = academic_year.start_date
+    start = SchoolCalendar.load().start_date
     return HttpResponseRedirect(f"/att/report-from/{start.year}/{start.month}/{start.day}/")
 
 
+def get_export_format(request):
+    export_format = request.GET.get("format", "csv")
+    if export_format not in EXPORT_FORMATS:
+        raise Http404(f"Unknown export format '{export_format}'")
+    return export_format
+
+@login_required
+def export_report_day(request, year, month, day):
+    """Export students that have any absence or late marks on given date."""
+    day = date(year, month, day)
+    return export_response(day_report_export_rows(day), f"report-{day.isoformat()}", get_export_format(request))
+
+@login_required
+def export_report_from(request, year, month, day):
+    """Export the number of absence and late marks of every student from given date."""
+    from_day = date(year, month, day)
+    return export_response(summary_export_rows(from_day), f"report-from-{from_day.isoformat()}", get_export_format(request))
+
+@login_required
+def export_report_student(request, student_id):
+    """Export all late or absent attendance records for given student."""
+    student = get_object_or_404(Student, pk=student_id)
+    return export_response(student_export_rows(student.id), f"report-{student.last_name}-{student.first_name}", get_export_format(request))
+
+@login_required
+def export_attendance(request):
+    """Export every absence and late mark of the whole school,
+    for the academic year or the 'from'/'to' dates given."""
+    calendar = SchoolCalendar.load()
+    try:
+        from_day = date.fromisoformat(request.GET.get("from", calendar.start_date.isoformat()))
+        to_day = date.fromisoformat(request.GET.get("to", calendar.end_date.isoformat()))
+    except ValueError as e:
+        raise Http404(str(e))
+    return export_response(school_export_rows(from_day, to_day), f"attendance-{from_day.isoformat()}-{to_day.isoformat()}", get_export_format(request))
+
+
 # TODO Fix minutes_late field
+@query_budget(10)
 @login_required
 @require_POST
 def mark_attendance(request):
@@ -455,10 +511,7 @@ def mark_attendance(request):
         student_id = data["studentId"]
         lesson_id = data["lessonId"]
 
-        student = Student.objects.get(id=student_id)
-        lesson = Lesson.objects.get(id=lesson_id)
-
-        attendance_record = AttendanceRecord.objects.get(student=student, lesson=lesson)
+        attendance_record = AttendanceRecord.objects.get(student_id=student_id, lesson_id=lesson_id)
 
         if attendance_record.status == "unregistered":
             attendance_record.status = "present"
@@ -474,17 +527,58 @@ def mark_attendance(request):
         attendance_record.marked_at = timezone.now()
 
         attendance_record.save()
+        invalidate_reports(refresh_record_summaries([attendance_record]))
 
         return JsonResponse({
             "status": "ok",
             "studentId": student_id,
             "attendanceStatus": attendance_record.status,
             "minutesLate": attendance_record.minutes_late,
-            "markedAt": attendance_record.marked_at
+            "markedAt": attendance_record.marked_at,
+            "version": record_version(attendance_record)
+        })
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
+@query_budget(12)
+@login_required
+@require_POST
+def mark_attendance_batch(request):
+    """Apply a batch of attendance changes in a single transaction.
+
+    Each change holds the version of the record it was made on; changes
+    to records marked since then are rejected and returned as conflicts
+    with the record's current state."""
+    try:
+        data = json.loads(request.body)
+        changes = [parse_attendance_change(change) for change in data["changes"]]
+        updated, conflicts = apply_attendance_changes(changes)
+        invalidate_reports(refresh_record_summaries(updated))
+        return JsonResponse({
+            "status": "ok",
+            "records": [record_to_dict(record) for record in updated],
+            "conflicts": [record_to_dict(record) for record in conflicts]
         })
     except Exception as e:
         return JsonResponse({"status": "error", "message": str(e)}, status=400)
 
+@query_budget(6)
+@login_required
+@require_http_methods(["GET", "POST"])
+def sync_lesson_attendance(request, lesson_id):
+    """Return a snapshot of the lesson's attendance records and,
+    on POST, merge a log of offline changes into them first."""
+    lesson = get_object_or_404(Lesson, pk=lesson_id)
+    try:
+        if request.method == "POST":
+            data = json.loads(request.body)
+            deltas = [parse_attendance_delta(delta) for delta in data["deltas"]]
+            updated = merge_attendance_deltas(lesson.id, deltas)
+            invalidate_reports(refresh_record_summaries(updated))
+        return JsonResponse({"status": "ok", **lesson_snapshot(lesson.id)})
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
+
 @login_required
 @require_POST
 def mark_unregistered_present(request):
@@ -492,7 +586,11 @@ def mark_unregistered_present(request):
     try:
         data = request.POST
         lesson_id = data["lessonId"]
-        AttendanceRecord.objects.filter(lesson_id=lesson_id).filter(status=AttendanceStatus.UNREGISTERED).update(status=AttendanceStatus.PRESENT, minutes_late=None, marked_at=timezone.now())
+        now = timezone.now()
+        # Unregistered to present changes no absent or late counts,
+        # so the daily summaries need no refresh.
+        AttendanceRecord.objects.filter(lesson_id=lesson_id).filter(status=AttendanceStatus.UNREGISTERED).update(status=AttendanceStatus.PRESENT, minutes_late=None, marked_at=now, updated_at=now)
+        invalidate_reports(dates=Lesson.objects.filter(pk=lesson_id).values_list("date", flat=True))
 
         return HttpResponseRedirect(request.META.get("HTTP_REFERER"))
     except Exception as e:
@@ -507,7 +605,6 @@ def setup(request):
     return render(request, "att/setup.html", context)
 
 
-# TODO Add/remove lessons and att records automatically when changing academic year dates.
 @login_required
 def setup_calendar(request):
     year = AcademicYear.objects.all()[0]
@@ -515,8 +612,10 @@ def setup_calendar(request):
     if request.method == 'POST':
         form = AcademicYearForm(request.POST, instance=year)
         if form.is_valid():
+            previous_calendar = SchoolCalendar.load()
             form.save()
-            return render(request, 'att/setup.html')
+            job = enqueue_calendar_change(previous_calendar, request.user)
+            return render(request, 'att/setup.html', {"job": job})
 
     else:
         form = AcademicYearForm(instance=year)
@@ -527,41 +626,30 @@ def setup_calendar(request):
 def setup_teachers(request):
     return render(request, "att/setup_teachers.html")
 
-def process_teachers_file(csvfile):
+def process_teachers_file(csvfile, upsert=False):
     with TextIOWrapper(csvfile, encoding='utf-8', newline='\n') as csv_text_file:
         reader = csv.reader(csv_text_file)
-        for row in reader:
-            u = User.objects.create_user(row[7].lower(), row[7].lower())
-            teacher = Teacher(user=u, first_name=row[1], last_name=row[2])
-            teacher.save()
+        return bulk_import_teachers(((row[7], row[1], row[2]) for row in reader), upsert)
 
 @require_POST
 @login_required
 def import_teachers(request):
-    process_teachers_file(request.FILES["teachers-file"])
+    process_teachers_file(request.FILES["teachers-file"], upsert="upsert" in request.POST)
     return render(request, "att/setup.html")
 
 @login_required
 def setup_students(request):
     return render(request, "att/setup_students.html")
 
-def process_students_file(csvfile):
+def process_students_file(csvfile, upsert=False):
     with TextIOWrapper(csvfile, encoding='utf-8', newline='\n') as csv_text_file:
         reader = csv.reader(csv_text_file)
-        for row in reader:
-            osection = row[7].replace('-', '')
-            s = Section.objects.get(name=osection)
-            osemail = row[4]
-            osfirstname = row[3]
-            oslastname = row[1] + ' ' + row[2]
-            student = Student(email=osemail, first_name=osfirstname, last_name=oslastname, section=s)
-            print(student)
-            student.save()
+        return bulk_import_students(((row[4], row[3], row[1] + ' ' + row[2], row[7].replace('-', '')) for row in reader), upsert)
 
 @require_POST
 @login_required
 def import_students(request):
-    process_students_file(request.FILES["students-file"])
+    process_students_file(request.FILES["students-file"], upsert="upsert" in request.POST)
     return render(request, "att/setup.html")
 
 
@@ -569,86 +657,77 @@ def import_students(request):
 def setup_courses(request):
     return render(request, "att/setup_courses.html")
 
-def temp_folder():
-    return Path("att/utils/tmp")
-
-def clean_temp_folder():
-    for file in temp_folder().glob('*'):
-        file.unlink()
-
-def save_to_temp(f):
-    with open(f"{temp_folder()}/{f}", "wb+") as tempxls:
-        for chunk in f.chunks():
-            tempxls.write(chunk)
-
-def xls_to_csv(folder):
-    for xlsfile in folder.glob(f'*.xls'):
-        if xlsfile.is_file():
-            excel = xlrd.open_workbook(str(xlsfile))
-            sheet = excel.sheet_by_index(0)
-            with open(folder / (xlsfile.stem + ".csv"), 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                for row in range(sheet.nrows):
-                    writer.writerow(sheet.row_values(row))
-
-def delete_course_files(folder):
-    for f in folder.glob(f'*.*'):
-        if f.is_file():
-            f.unlink()
-
-def add_enrolments(course, student_emails, test=False):
-    for student_email in student_emails:
-        student = Student.objects.get(email=student_email)
-        enrolment = Enrolment(student=student, course=course)
-        if test:
-            pass
-        else:
-            enrolment.save()
-
-
-def process_course_files(folder, test=False):
-    for csvfile in temp_folder().glob(f'*.csv'):
-        if csvfile.is_file():
-            parser = Parser()
-            course_data = parser.parse(csvfile)
-            try:
-                t = Teacher.objects.annotate(fname = Concat('first_name', Value(' '), 'last_name')).get(fname=course_data['teacher'].strip())
-                course = Course(name=f'{course_data["name"]} - {course_data["sections"]}',
-                                level=12,
-                                teacher=t,
-                                weekly_sessions=4)
-                if test:
-                    print(course)
-                else:
-                    course.save()
-                    add_enrolments(course, course_data['students'], test)
-            except Exception as e:
-                print(f"Couldn't find a teacher called {course_data['teacher'].strip()}")
+@require_POST
+@login_required
+def update_enrolments(request):
+    """Enrol and unenrol several students in a course at once,
+    adding or removing their records of the course's remaining lessons."""
+    try:
+        data = json.loads(request.body)
+        course = Course.objects.get(pk=int(data["courseId"]))
+        add_ids = {int(student_id) for student_id in data.get("add", [])}
+        remove_ids = {int(student_id) for student_id in data.get("remove", [])}
+    except Course.DoesNotExist:
+        return JsonResponse({"error": "Course not found"}, status=400)
+    except (KeyError, ValueError, TypeError):
+        return JsonResponse({"error": "Invalid or missing parameters"}, status=400)
+
+    with transaction.atomic():
+        add_ids = set(Student.objects.filter(pk__in=add_ids).exclude(enrolment__course=course).values_list("id", flat=True))
+        Enrolment.objects.bulk_create([Enrolment(student_id=student_id, course=course) for student_id in add_ids])
+        added = do_add_enrolment_records((student_id, course.id) for student_id in add_ids)
+        removed_enrolments = Enrolment.objects.filter(course=course, student_id__in=remove_ids)
+        removed_ids = list(removed_enrolments.values_list("student_id", flat=True))
+        removed_pairs = [(student_id, course.id) for student_id in removed_ids]
+        removed = do_remove_enrolment_records(removed_pairs)
+        # The records were removed in bulk, so the post_delete
+        # receiver doesn't remove them again one enrolment at a time.
+        with enrolment_records_removed(removed_pairs):
+            removed_enrolments.delete()
+    # bulk_create sends no post_save signals.
+    bump_version("occupancy")
+
+    return JsonResponse({
+        "status": "ok",
+        "course": course.id,
+        "enrolled": sorted(add_ids),
+        "unenrolled": sorted(removed_ids),
+        "att_record_num": added,
+        "att_record_removed_num": removed
+    })
+
 
 @require_POST
 @login_required
 def import_courses(request):
-    clean_temp_folder()
-    for f in request.FILES.getlist("courses-file"):
-        save_to_temp(f)
-    xls_to_csv(temp_folder())
-    process_course_files(temp_folder(), False)
-    delete_course_files(temp_folder())
-    return render(request, "att/setup.html")
+    files = request.FILES.getlist("courses-file")
+    job = enqueue_job("import-courses", lock_key="courses", attachments=[(f.name, f.read()) for f in files], user=request.user)
+    return render(request, "att/setup.html", {"job": job})
 
 class SetupTimetables(LoginRequiredMixin, generic.ListView):
     """Setup courses' weekly timetables."""
     template_name = "att/setup_timetables.html"
     model = Course
+    query_budget = 16
 
     def get_queryset(self):
         return Course.objects.order_by("name").annotate(pending_sessions=F("weekly_sessions")-Count("weeklyschedule"))
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        conflicts = get_occupancy_index().scan()
+        conflicting_courses = {course_id for conflict in conflicts for course_id in conflict.course_ids}
+        for course in context["object_list"]:
+            course.has_conflicts = course.id in conflicting_courses
+        context["conflicts"] = conflicts_to_dicts(conflicts)
+        return context
+
 class SetupTimetable(LoginRequiredMixin, generic.ListView):
     """Setup a specific course's weekly timetable."""
     template_name = "att/setup_timetable.html"
     model = WeeklySchedule
     context_object_name = "schedules"
+    query_budget = 8
 
     def get_queryset(self):
         self.course = get_object_or_404(Course, pk=self.kwargs["pk"])
@@ -657,17 +736,12 @@ class SetupTimetable(LoginRequiredMixin, generic.ListView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["course"] = self.course
-        context["periods"] = Period.objects.all()
-        buttons = []
-        for p in Period.objects.all():
-            buttonsrow = {"period": p, "buttons": []}
-            for d in range(1,6):
-                if WeeklySchedule.objects.filter(course=self.course, iso_weekday=d, period=p).first():
-                    buttonsrow["buttons"].append({"day": d, "scheduled": True})
-                else:
-                    buttonsrow["buttons"].append({"day": d, "scheduled": False})
-            buttons.append(buttonsrow)
-        context["buttons"] = buttons
+        context["periods"] = get_periods()
+        scheduled = {(ws.period_id, ws.iso_weekday) for ws in self.object_list}
+        context["buttons"] = [
+            {"period": p, "buttons": [{"day": d, "scheduled": (p.id, d) in scheduled} for d in range(1, 6)]}
+            for p in context["periods"]
+        ]
         return context
 
 
@@ -693,9 +767,12 @@ def toggle_schedule(request):
     except Period.DoesNotExist:
         return JsonResponse({"error": "Period not found"}, status=400)
 
-    course_start = AcademicYear.objects.all()[0].start_date
-    course_end = AcademicYear.objects.all()[0].end_date + timedelta(days=1)
-
+    # The schedule is toggled right away and its lessons are generated
+    # or deleted by a job. Timetable jobs share a lock key, so they run
+    # in the order the schedules were toggled.
+    index = get_occupancy_index()
+    slot = (c.id, p.id, iso_weekday)
+    conflicts = []
     with transaction.atomic():
         existing = WeeklySchedule.objects.filter(
             course=c,
@@ -703,16 +780,77 @@ def toggle_schedule(request):
             period=p
         ).first()
         if existing:
-            do_delete_lessons(existing, course_start, course_end)
             existing.delete()
             status = "deleted"
+            action = "delete"
         else:
-            schedule = WeeklySchedule(course=c, iso_weekday=iso_weekday, period=p)
-            schedule.save()
-            do_generate_lessons_and_att_records(ws=schedule, from_date=course_start, to_date=course_end)
+            # Conflicts are reported, not prevented.
+            conflicts = index.conflicts(*slot)
+            WeeklySchedule.objects.create(course=c, iso_weekday=iso_weekday, period=p)
             status = "created"
+            action = "generate"
+        job = enqueue_job("schedule-lessons", {"course": c.id, "period": p.id, "iso_weekday": iso_weekday, "action": action}, lock_key="timetable", user=request.user)
+    # Saving or deleting the schedule bumped the "occupancy" version once.
+    if existing:
+        update_occupancy_index(index, 1, removed=[slot])
+    else:
+        update_occupancy_index(index, 1, added=[slot])
+    return JsonResponse({"status": status, "course": c.id, "iso_weekday": iso_weekday, "period": p.id, "job": job_to_dict(job), "conflicts": conflicts_to_dicts(conflicts)})
 
-    return JsonResponse({"status": status, "course": c.id, "iso_weekday": iso_weekday, "period": p.id})
+@query_budget(22)
+@require_POST
+@login_required
+def update_timetable(request):
+    """Replace the weekly timetables of one or more courses at once.
+
+    The body holds the full set of scheduled slots of each course:
+    {"courses": [{"courseId": ..., "slots": [{"periodId": ..., "day": ...}, ...]}, ...]}.
+    Weekly schedules are created and deleted right away, and the lessons
+    of all of them are generated or deleted by a single job."""
+    try:
+        data = json.loads(request.body)
+        timetables = {
+            int(course["courseId"]): {(int(slot["periodId"]), int(slot["day"])) for slot in course["slots"]}
+            for course in data["courses"]
+        }
+    except (KeyError, ValueError, TypeError):
+        return JsonResponse({"error": "Invalid or missing parameters"}, status=400)
+
+    slots = {(course_id, period_id, iso_weekday) for course_id, course_slots in timetables.items() for period_id, iso_weekday in course_slots}
+    if any(not (1 <= iso_weekday <= 7) for _, _, iso_weekday in slots):
+        return JsonResponse({"error": "Weekday must be between 1 and 7"}, status=400)
+    if Course.objects.filter(pk__in=timetables).count() != len(timetables):
+        return JsonResponse({"error": "Course not found"}, status=400)
+    period_ids = {period_id for _, period_id, _ in slots}
+    if Period.objects.filter(pk__in=period_ids).count() != len(period_ids):
+        return JsonResponse({"error": "Period not found"}, status=400)
+
+    index = get_occupancy_index()
+    with transaction.atomic():
+        existing = set(WeeklySchedule.objects.filter(course_id__in=timetables).values_list("course_id", "period_id", "iso_weekday"))
+        added = sorted(slots - existing)
+        removed = sorted(existing - slots)
+        WeeklySchedule.objects.bulk_create([
+            WeeklySchedule(course_id=course_id, period_id=period_id, iso_weekday=iso_weekday)
+            for course_id, period_id, iso_weekday in added
+        ])
+        # Each schedule deleted bumps the "occupancy" version once.
+        bumps = 0
+        if removed:
+            bumps, _ = WeeklySchedule.objects.filter(schedule_filter(removed)).delete()
+        job = None
+        if added or removed:
+            job = enqueue_job("update-schedules", {"added": added, "removed": removed}, lock_key="timetable", user=request.user)
+    if added:
+        # bulk_create sends no post_save signals.
+        bump_version("timetable")
+        bump_version("occupancy")
+        bumps += 1
+
+    # Conflicts of the new slots, between themselves too, are reported, not prevented.
+    index = update_occupancy_index(index, bumps, added, removed)
+    conflicts = {conflict for slot in added for conflict in index.conflicts(*slot)}
+    return JsonResponse({"status": "ok", "added": added, "removed": removed, "job": job_to_dict(job) if job else None, "conflicts": conflicts_to_dicts(conflicts)})
 
 class SetupNonSchoolDays(generic.ListView):
     """Setup non-school days in calendar."""
@@ -729,8 +867,8 @@ def setup_lessons(request):
 @require_POST
 @login_required
 def generate_lessons(request):
-    results = do_generate_all_lessons()
-    return JsonResponse({"status": "ok", "lesson_num": results})
+    job = enqueue_job("generate-lessons", lock_key="timetable", user=request.user)
+    return JsonResponse({"status": "ok", "job": job_to_dict(job)})
 
 # TODO Remove the ability to generate attendance records directly.
 # They should be added or removed automatically by scheduling weekly lessons.
@@ -742,5 +880,17 @@ def setup_attendance_records(request):
 @require_POST
 @login_required
 def generate_attendance_records(request):
-    results = do_generate_all_attendance_records()
-    return JsonResponse({"status": "ok", "att_record_num": results})
+    job = enqueue_job("reconcile-attendance-records", {"delete_orphans": "delete-orphans" in request.POST}, lock_key="timetable", user=request.user)
+    return JsonResponse({"status": "ok", "job": job_to_dict(job)})
+
+@staff_member_required
+def query_stats_view(request):
+    """Return rolling percentiles of the query count and timings of each view
+    recorded by this process, when the query stats middleware is enabled."""
+    return JsonResponse({"status": "ok", "enabled": settings.QUERY_STATS, **query_stats.summary()})
+
+@login_required
+def job_status(request, job_id):
+    """Return the status, progress and result of a background job."""
+    job = get_object_or_404(Job, pk=job_id)
+    return JsonResponse({"status": "ok", "job": job_to_dict(job)})
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+from django.core.cache import cache
+
+from .cache import get_version
+from .models import AttendanceRecord, Lesson, Period, Teacher
+
+# Cached grids are also invalidated by the "timetable" version;
+# the timeout only bounds how long unused grids are kept.
+WEEK_GRID_TIMEOUT = 60 * 60 * 24
+
+_periods = None
+_periods_lock = threading.Lock()
+
+
+def get_periods():
+    """Return the periods ordered by start time.
+
+    They are loaded once per process and reloaded when the "timetable"
+    version changes, which saving or deleting a period does."""
+    global _periods
+    version = get_version("timetable")
+    periods = _periods
+    if periods is None or periods[0] != version:
+        with _periods_lock:
+            if _periods is None or _periods[0] != version:
+                _periods = (version, list(Period.objects.all().order_by("start_time")))
+            periods = _periods
+    return periods[1]
+
+def build_week_grid(teacher: Teacher, start_of_week: date):
+    """Return the periods and, for each day from Monday to Friday,
+    the teacher's lesson in each period (None if there is none)
+    as ([period, ...], [(day, [(period, lesson), ...]), ...]).
+
+    Lessons are fetched with their course and period in a single query."""
+    week_days = [start_of_week + timedelta(days=i) for i in range(5)]
+    periods = get_periods()
+    lessons = Lesson.objects.filter(teacher=teacher).filter(date__range=(week_days[0], week_days[-1])).select_related("course", "period")
+    lessons_by_day = {day: {} for day in week_days}
+    for lesson in lessons:
+        lessons_by_day[lesson.date][lesson.period_id] = lesson
+    grid = [(day, [(period, lessons_by_day[day].get(period.id)) for period in periods]) for day in week_days]
+    return periods, grid
+
+def week_grid_key(teacher: Teacher, start_of_week: date):
+    iso_year, iso_week, _ = start_of_week.isocalendar()
+    return f"att:week-grid:{teacher.id}:{iso_year}-{iso_week}:{get_version('timetable')}"
+
+def get_week_grid(teacher: Teacher, start_of_week: date):
+    """Return the teacher's week grid, as 'build_week_grid' does,
+    from the cache if the timetable hasn't changed since it was built."""
+    key = week_grid_key(teacher, start_of_week)
+    week_grid = cache.get(key)
+    if week_grid is None:
+        week_grid = build_week_grid(teacher, start_of_week)
+        cache.set(key, week_grid, WEEK_GRID_TIMEOUT)
+    return week_grid
+
+def week_start_of(d: date):
+    return d - timedelta(days=d.isoweekday() - 1)
+
+def build_week_lesson_sequence(teacher_id, week_start: date):
+    """Return the teacher's lessons in the week as an ordered list of
+    (start_datetime, lesson id) pairs."""
+    lessons = Lesson.objects.filter(teacher_id=teacher_id).filter(date__range=(week_start, week_start + timedelta(days=6))).exclude(start_datetime=None)
+    return list(lessons.order_by("start_datetime", "id").values_list("start_datetime", "id"))
+
+def get_week_lesson_sequence(teacher_id, week_start: date):
+    """Return the teacher's ordered lesson sequence for the week,
+    as 'build_week_lesson_sequence' does, from the cache if possible."""
+    iso_year, iso_week, _ = week_start.isocalendar()
+    key = f"att:week-lessons:{teacher_id}:{iso_year}-{iso_week}:{get_version('timetable')}"
+    sequence = cache.get(key)
+    if sequence is None:
+        sequence = build_week_lesson_sequence(teacher_id, week_start)
+        cache.set(key, sequence, WEEK_GRID_TIMEOUT)
+    return sequence
+
+def next_lesson_id(current_lesson: Lesson):
+    """Return the id of the teacher's lesson following 'current_lesson'.
+
+    It is looked up in the cached sequence of the week's lessons,
+    falling back on a single LIMIT 1 query at the end of the week."""
+    if current_lesson.start_datetime is None:
+        return None
+    sequence = get_week_lesson_sequence(current_lesson.teacher_id, week_start_of(current_lesson.date))
+    i = bisect_right(sequence, current_lesson.start_datetime, key=lambda item: item[0])
+    if i < len(sequence):
+        return sequence[i][1]
+    nl = Lesson.objects.filter(teacher_id=current_lesson.teacher_id).filter(start_datetime__gt=current_lesson.start_datetime).order_by("start_datetime")
+    return nl.values_list("id", flat=True).first()
+
+def previous_lesson_id(current_lesson: Lesson):
+    """Return the id of the teacher's lesson preceding 'current_lesson'.
+
+    It is looked up in the cached sequence of the week's lessons,
+    falling back on a single LIMIT 1 query at the start of the week."""
+    if current_lesson.start_datetime is None:
+        return None
+    sequence = get_week_lesson_sequence(current_lesson.teacher_id, week_start_of(current_lesson.date))
+    i = bisect_left(sequence, current_lesson.start_datetime, key=lambda item: item[0])
+    if i > 0:
+        return sequence[i - 1][1]
+    pl = Lesson.objects.filter(teacher_id=current_lesson.teacher_id).filter(start_datetime__lt=current_lesson.start_datetime).order_by("-start_datetime")
+    return pl.values_list("id", flat=True).first()
+
+def build_student_week_grids(records, start_of_week: date):
+    """Return, for each student in the attendance 'records' of the week,
+    the student's record in each period of each day from Monday to Friday
+    (None if there is none) as {student_id: [(day, [(period, record), ...]), ...]}.
+
+    'records' is evaluated as a single query, with each record's lesson
+    and course, and pivoted with the periods from 'get_periods'."""
+    week_days = [start_of_week + timedelta(days=i) for i in range(5)]
+    periods = get_periods()
+    records = records.filter(lesson__date__range=(week_days[0], week_days[-1])).select_related("lesson__course")
+    records_by_student = {}
+    for record in records:
+        records_by_student.setdefault(record.student_id, {}).setdefault((record.lesson.date, record.lesson.period_id), record)
+    return {
+        student_id: [(day, [(period, student_records.get((day, period.id))) for period in periods]) for day in week_days]
+        for student_id, student_records in records_by_student.items()
+    }
+
+def build_student_week_grid(student_id, start_of_week: date):
+    """Return the student's week grid, as 'build_student_week_grids' does."""
+    grids = build_student_week_grids(AttendanceRecord.objects.filter(student_id=student_id), start_of_week)
+    return grids.get(student_id) or build_empty_week_grid(start_of_week)
+
+def build_empty_week_grid(start_of_week: date):
+    return [(start_of_week + timedelta(days=i), [(period, None) for period in get_periods()]) for i in range(5)]
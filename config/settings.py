@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import environ
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +41,9 @@ GOOGLE_OAUTH_PROJECT_ID = env('GOOGLE_OAUTH_PROJECT_ID')
 ALLOWED_HOSTS = env.list('DJANGO_ALLOWED_HOSTS')
 CSRF_TRUSTED_ORIGINS = env.list('DJANGO_CSRF_TRUSTED_ORIGINS')
 
+# Record query counts and timings per view (see att/querystats.py).
+QUERY_STATS = env.bool('QUERY_STATS', default=False)
+
 
 # Application definition
 
@@ -58,6 +63,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'att.querystats.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -100,6 +106,25 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Cached reports, week grids and the student search index are invalidated
+# through version counters kept in the cache, so it must be shared by every
+# worker and the runjobs command: never use a per-process cache such as
+# locmemcache:// in production. A file cache in the temporary directory by
+# default; set CACHE_URL for another one, e.g. dbcache://att_cache (after
+# running `manage.py createcachetable`) or redis://.
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default=f"filecache://{Path(tempfile.gettempdir()) / 'att_cache'}?max_entries=20000")
+}
+
+# Tests clear the cache, which must not be the one of a running site.
+if sys.argv[1:2] == ['test']:
+    CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators